@@ -0,0 +1,113 @@
+"""Measures trace time and peak memory against synthetic site maps of growing size.
+
+Under Jython the full TracerTreeModel.refresh runs against the fake callbacks;
+elsewhere only the engine (site map snapshot and matching) is measured.
+
+    python benchmarks/benchmark.py [--sizes 250,500,1000,2000] [--parameters 3]
+                                   [--body-size 2048] [--density 2.0] [--threads 1]
+"""
+
+import argparse
+import gc
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakeburp import FakeCallbacks
+from fakeburp import generateSiteMap
+from fakeburp import installBurpModule
+from tracer_engine import ResponseFilter
+from tracer_engine import SiteMapSnapshot
+from tracer_engine import TraceIndex
+from tracer_engine import ValueFilter
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+class FakeExtender:
+
+    def __init__(self, threads):
+        self.threads = threads
+        self.valueFilter = ValueFilter()
+        self.responseFilter = ResponseFilter()
+
+    def progressCallbackInput(self, label, current, maximum, detail=None):
+        pass
+
+    def progressCallbackOutput(self, label, current, maximum, detail=None):
+        pass
+
+def loadTracer():
+    installBurpModule()
+    try:
+        import tracer
+    except ImportError:
+        return None
+    return tracer
+
+def traceEngine(callbacks, threads):
+    snapshot = SiteMapSnapshot(callbacks)
+    snapshot.capture(lambda *args: None)
+    index = TraceIndex()
+    return len(index.add(snapshot.items, None, threads)), len(index.inputs)
+
+def traceModel(tracer, callbacks, threads):
+    model = tracer.TracerTreeModel(FakeExtender(threads), callbacks)
+    model.refresh()
+    return len(model.edges), len(model.index.inputs)
+
+def measure(function):
+    """Runs function and returns its result, the elapsed seconds and the peak memory in bytes."""
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result, elapsed, peak
+    from java.lang.management import ManagementFactory
+    from java.lang.management import MemoryType
+    pools = [pool for pool in ManagementFactory.getMemoryPoolMXBeans() if pool.type == MemoryType.HEAP]
+    for pool in pools:
+        pool.resetPeakUsage()
+    start = time.time()
+    result = function()
+    elapsed = time.time() - start
+    return result, elapsed, sum(pool.peakUsage.used for pool in pools)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Tracer against synthetic site maps.')
+    parser.add_argument('--sizes', default='250,500,1000,2000', help='comma-separated site map sizes')
+    parser.add_argument('--parameters', type=int, default=3, help='parameters per request')
+    parser.add_argument('--body-size', type=int, default=2048, help='approximate response body size')
+    parser.add_argument('--density', type=float, default=2.0, help='average reflections per response')
+    parser.add_argument('--threads', type=int, default=1, help='scan threads')
+    parser.add_argument('--engine', action='store_true', help='measure only the engine even under Jython')
+    args = parser.parse_args(argv)
+    tracer = None if args.engine else loadTracer()
+    print('Measuring {}'.format('TracerTreeModel.refresh' if tracer else 'engine (snapshot and matching)'))
+    print('{:>8} {:>8} {:>10} {:>10} {:>10} {:>12} {:>8}'.format('items', 'values', 'hits', 'time (s)', 'peak (MB)', 'ms / item', 'growth'))
+    previous = None
+    for size in [int(size) for size in args.sizes.split(',')]:
+        callbacks = FakeCallbacks(generateSiteMap(size, args.parameters, args.body_size, args.density))
+        if tracer:
+            (hits, values), elapsed, peak = measure(lambda: traceModel(tracer, callbacks, args.threads))
+        else:
+            (hits, values), elapsed, peak = measure(lambda: traceEngine(callbacks, args.threads))
+        # Growth is the exponent k in time ~ items^k between consecutive sizes
+        growth = '-'
+        if previous and elapsed > 0 and previous[1] > 0 and size != previous[0]:
+            growth = '{:.2f}'.format(math.log(elapsed / previous[1]) / math.log(float(size) / previous[0]))
+        print('{:>8} {:>8} {:>10} {:>10.3f} {:>10.1f} {:>12.3f} {:>8}'.format(size, values, hits, elapsed, peak / 1048576.0, 1000.0 * elapsed / size, growth))
+        previous = (size, elapsed)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Local stand-ins for the parts of the Burp Extender API used by Tracer."""
+
+import os
+import random
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracer_engine import requestParameters
+from tracer_engine import splitMessage
+
+class FakeBytes(str):
+    """A str that also answers tostring(), like the jarray byte[] Burp hands out."""
+
+    def tostring(self):
+        return str(self)
+
+class FakeHttpService:
+
+    def __init__(self, protocol, host, port):
+        self.protocol = protocol
+        self.host = host
+        self.port = port
+
+class FakeHttpRequestResponse:
+
+    def __init__(self, httpService, request, response):
+        self.httpService = httpService
+        self.request = FakeBytes(request)
+        self.response = FakeBytes(response) if response is not None else None
+
+class FakeRequestInfo:
+
+    def __init__(self, url, method, parameters):
+        self.url = url
+        self.method = method
+        self.parameters = parameters
+
+class FakeResponseInfo:
+
+    def __init__(self, bodyOffset, statusCode, mimeType):
+        self.bodyOffset = bodyOffset
+        self.statusCode = statusCode
+        self.statedMimeType = mimeType
+        self.inferredMimeType = mimeType
+
+class FakeExtensionHelpers:
+
+    def analyzeRequest(self, httpService, request):
+        line, headers, offset = splitMessage(request.tostring())
+        method, target = line.split(' ')[:2]
+        url = '{}://{}:{}{}'.format(httpService.protocol, httpService.host, httpService.port, target)
+        return FakeRequestInfo(url, method, requestParameters(url, headers, request.tostring()[offset:]))
+
+    def analyzeResponse(self, response):
+        line, headers, offset = splitMessage(response.tostring())
+        mimeType = ''
+        for name, value in headers:
+            if name.lower() == 'content-type':
+                mimeType = value.split('/')[-1].split(';')[0].upper()
+        return FakeResponseInfo(offset, int(line.split(' ')[1]), mimeType)
+
+class FakeCallbacks:
+    """Serves a fixed site map; every URL is in scope unless a scope prefix is given."""
+
+    def __init__(self, sitemap, scope=None):
+        self.sitemap = sitemap
+        self.scope = scope
+        self.helpers = FakeExtensionHelpers()
+
+    def getSiteMap(self, prefix):
+        return [pair for pair in self.sitemap if prefix is None or str(self.helpers.analyzeRequest(pair.httpService, pair.request).url).startswith(prefix)]
+
+    def isInScope(self, url):
+        return self.scope is None or str(url).startswith(self.scope)
+
+    def setExtensionName(self, name):
+        pass
+
+    def addSuiteTab(self, tab):
+        pass
+
+    def registerHttpListener(self, listener):
+        pass
+
+    def registerExtensionStateListener(self, listener):
+        pass
+
+def installBurpModule():
+    """Registers a fake burp module so that tracer.py can be imported outside Burp."""
+    module = types.ModuleType('burp')
+    for name in ['IBurpExtender', 'IExtensionStateListener', 'IHttpListener', 'IParameter', 'ITab']:
+        setattr(module, name, type(name, (object,), dict()))
+    sys.modules['burp'] = module
+
+def generateSiteMap(items, parameters=3, bodySize=2048, density=2.0, seed=0):
+    """Generates a synthetic site map.
+
+    Every request carries the given number of parameters with random values,
+    and every response body is about bodySize characters of filler with on
+    average density reflections of values taken from anywhere in the site map.
+    """
+    rng = random.Random(seed)
+    alphabet = 'abcdefghijklmnopqrstuvwxyz0123456789'
+    words = [''.join(rng.choice(alphabet) for i in range(rng.randint(2, 9))) for i in range(512)]
+    service = FakeHttpService('https', 'bench.example', 443)
+    values = [[''.join(rng.choice(alphabet) for i in range(12)) for j in range(parameters)] for k in range(items)]
+    sitemap = list()
+    for index in range(items):
+        query = '&'.join('p{}={}'.format(j, value) for j, value in enumerate(values[index]))
+        request = 'GET /endpoint{}?{} HTTP/1.1\r\nHost: {}\r\n\r\n'.format(index % max(1, items // 10), query, service.host)
+        body = list()
+        size = 0
+        while size < bodySize:
+            word = rng.choice(words)
+            body.append(word)
+            size += len(word) + 1
+        for i in range(int(density) + (1 if rng.random() < density - int(density) else 0)):
+            body.insert(rng.randint(0, len(body)), rng.choice(values[rng.randrange(items)]))
+        response = 'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n' + ' '.join(body)
+        sitemap.append(FakeHttpRequestResponse(service, request, response))
+    return sitemap
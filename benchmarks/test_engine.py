@@ -0,0 +1,418 @@
+"""Tests for the headless parts of the tracing engine.
+
+Runs under CPython or Jython, without Burp:
+
+    python -m unittest discover -s benchmarks
+"""
+
+import base64
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tracer_engine
+from fakeburp import FakeCallbacks
+from fakeburp import FakeHttpRequestResponse
+from fakeburp import generateSiteMap
+from tracer_engine import Contexts
+from tracer_engine import Encodings
+from tracer_engine import ExportReader
+from tracer_engine import HarEntries
+from tracer_engine import Matcher
+from tracer_engine import ShardPool
+from tracer_engine import SiteMapSnapshot
+from tracer_engine import TraceIndex
+from tracer_engine import TraceStore
+from tracer_engine import ValueFilter
+
+def runs(text, base=0):
+    """Returns the (context, text) runs of a tokenized body."""
+    bounds, labels = Contexts.tokenize(text, base)
+    ends = bounds[1:] + [len(text) - base]
+    return [(label, text[base + start:base + end]) for start, end, label in zip(bounds, ends, labels) if end > start]
+
+def keys(hits):
+    """Returns the hits of a trace in a comparable form."""
+    return sorted((item.index, param.name, sitem.index, offset, length, encoding) for item, param, sitem, offset, length, encoding in hits)
+
+class Stopper:
+    """Progress callback that sets stopping once after outputs have been scanned."""
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.stopping = threading.Event()
+
+    def __call__(self, sitem, current, maximum):
+        self.outputs -= 1
+        if self.outputs == 0:
+            self.stopping.set()
+
+class MatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        # Exercise the pure-Python automaton even where pyahocorasick is installed
+        self.ahocorasick = tracer_engine.ahocorasick
+        tracer_engine.ahocorasick = None
+
+    def tearDown(self):
+        tracer_engine.ahocorasick = self.ahocorasick
+
+    def test_overlapping(self):
+        matcher = Matcher(['he', 'she', 'his', 'hers'])
+        self.assertEqual(sorted(matcher.finditer('ushers')), [('he', 2), ('hers', 2), ('she', 1)])
+
+    def test_start(self):
+        matcher = Matcher(['ab'])
+        self.assertEqual(list(matcher.finditer('ab xab', 2)), [('ab', 2)])
+
+    def test_empty(self):
+        self.assertEqual(list(Matcher(['']).finditer('anything')), [])
+        self.assertEqual(list(Matcher(['abc']).finditer('')), [])
+
+    def test_agrees_with_find(self):
+        values = ['aa', 'aab', 'ba', 'b', 'abab']
+        text = 'aababbaabababbba'
+        expected = sorted((value, index) for value in values for index in range(len(text)) if text.startswith(value, index))
+        self.assertEqual(sorted(Matcher(values).finditer(text)), expected)
+
+class EncodingsTest(unittest.TestCase):
+
+    def test_json_unicode_escapes(self):
+        variants = dict(Encodings.variants("<b>'bob'</b> & co"))
+        self.assertEqual(variants['\\u003cb\\u003e\\u0027bob\\u0027\\u003c/b\\u003e \\u0026 co'], Encodings.Json)
+        self.assertEqual(variants['\\u003Cb\\u003E\\u0027bob\\u0027\\u003C/b\\u003E \\u0026 co'], Encodings.Json)
+
+    def test_url_encoded_input(self):
+        variants = dict(Encodings.variants('alice%3Cx%3E'))
+        self.assertEqual(variants['alice<x>'], Encodings.UrlDecoded)
+        self.assertEqual(variants['alice&lt;x&gt;'], Encodings.Html)
+        self.assertEqual(variants['alice\\u003cx\\u003e'], Encodings.Json)
+        self.assertEqual(variants['ALICE<X>'], Encodings.Uppercase)
+
+    def test_distinct(self):
+        self.assertEqual(Encodings.variants('plain'), [('plain', Encodings.Raw), ('PLAIN', Encodings.Uppercase)])
+
+class TraceIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batch = TraceIndex.BATCH
+        TraceIndex.BATCH = 8
+        snapshot = SiteMapSnapshot(FakeCallbacks(generateSiteMap(60, bodySize=256, density=4.0)))
+        self.items = [snapshot.add(pair) for pair in snapshot.callbacks.getSiteMap(None)]
+        self.expected = keys(self.index().add(self.items))
+        self.assertTrue(self.expected)
+
+    def tearDown(self):
+        TraceIndex.BATCH = self.batch
+
+    def index(self):
+        return TraceIndex(filter=ValueFilter(cap=0))
+
+    def test_incremental(self):
+        index = self.index()
+        hits = list()
+        for start in range(0, len(self.items), 7):
+            hits.extend(index.add(self.items[start:start + 7]))
+        self.assertEqual(keys(hits), self.expected)
+
+    def test_stop_and_resume(self):
+        # Stop the search of existing outputs for the values of the second add
+        index = self.index()
+        hits = index.add(self.items[:30])
+        stopper = Stopper(5)
+        hits.extend(index.add(self.items[30:45], stopper, 1, stopper.stopping))
+        self.assertTrue(index.pending)
+        self.assertLess(len(index.scanned()), 30)
+        hits.extend(index.add(self.items[45:]))
+        self.assertFalse(index.pending)
+        self.assertEqual(len(index.scanned()), len(self.items))
+        self.assertEqual(keys(hits), self.expected)
+
+    def test_stopped_outputs_are_scanned_later(self):
+        # Outputs left unscanned by a stop are neither lost nor counted as scanned
+        index = self.index()
+        stopper = Stopper(20)
+        hits = index.add(self.items, stopper, 2, stopper.stopping)
+        self.assertLess(len(index.scanned()), len(self.items))
+        hits.extend(index.add([]))
+        self.assertEqual(len(index.scanned()), len(self.items))
+        self.assertEqual(keys(hits), self.expected)
+
+    def test_shared_bodies(self):
+        # Copies of every body under other requests, in reverse order so that
+        # copies land both in the batch of their original and batches apart
+        sitemap = generateSiteMap(40, bodySize=256, density=4.0)
+        copies = [FakeHttpRequestResponse(pair.httpService, pair.request.replace('?', '?copy=1&', 1), pair.response) for pair in reversed(sitemap)]
+        snapshot = SiteMapSnapshot(FakeCallbacks(sitemap + copies))
+        items = [snapshot.add(pair) for pair in snapshot.callbacks.getSiteMap(None)]
+        originals, copies = items[:40], items[:39:-1]
+        for original, copy in zip(originals, copies):
+            self.assertIs(copy.message, original.message)
+        hits = self.index().add(items, None, 3)
+        found = dict()
+        for item, param, sitem, offset, length, encoding in hits:
+            found.setdefault(sitem.index, set()).add((item.index, param.name, offset, length, encoding))
+        self.assertTrue(found)
+        for original, copy in zip(originals, copies):
+            self.assertEqual(found.get(copy.index), found.get(original.index))
+
+    def test_cap_per_value(self):
+        # 'Token' and 'token' share the variant token, which only the first reaches the cap in
+        service = self.items[0].service
+        request = lambda path: 'GET {} HTTP/1.1\r\nHost: a\r\n\r\n'.format(path)
+        response = lambda body: 'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n' + body
+        sitemap = [FakeHttpRequestResponse(service, request('/a?q=Token'), response('')), FakeHttpRequestResponse(service, request('/b?q=token'), response(''))]
+        sitemap.extend(FakeHttpRequestResponse(service, request('/p{}'.format(page)), response('Token Token' if page < 3 else 'token token')) for page in range(6))
+        snapshot = SiteMapSnapshot(FakeCallbacks(sitemap))
+        snapshot.capture(lambda *args: None)
+        index = TraceIndex(filter=ValueFilter(cap=5))
+        found = dict()
+        for item, param, sitem, offset, length, encoding in index.add(snapshot.items):
+            found.setdefault(item.url, list()).append((sitem.url, offset, encoding))
+        self.assertEqual([len(found[item.url]) for item in snapshot.items[:2]], [5, 5])
+        self.assertTrue(all(url.endswith(('/p0', '/p1', '/p2')) for url, offset, encoding in found[snapshot.items[0].url]))
+        # New requests for known values replay only the hits that the value kept
+        sitemap = [FakeHttpRequestResponse(service, request('/c?q=Token'), response('')), FakeHttpRequestResponse(service, request('/d?q=token'), response(''))]
+        replayed = index.add([snapshot.add(pair) for pair in sitemap])
+        self.assertEqual(sorted((sitem.url, offset, encoding) for item, param, sitem, offset, length, encoding in replayed if param.value == 'Token'), sorted(found[snapshot.items[0].url]))
+        self.assertEqual(sorted((sitem.url, offset, encoding) for item, param, sitem, offset, length, encoding in replayed if param.value == 'token'), sorted(found[snapshot.items[1].url]))
+
+class ShardPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        sitemap = generateSiteMap(40, bodySize=256, density=4.0)
+        # Shared bodies, and a body that is not ASCII
+        sitemap.extend(FakeHttpRequestResponse(pair.httpService, pair.request.replace('?', '?copy=1&', 1), pair.response) for pair in sitemap[::3])
+        value = sitemap[0].request.split('p0=')[1].split('&')[0]
+        sitemap.append(FakeHttpRequestResponse(sitemap[0].httpService, sitemap[0].request, 'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n\xe9t\xe9 ' + value))
+        self.callbacks = FakeCallbacks(sitemap)
+        self.pool = ShardPool(2048, sys.executable, 2)
+
+    def tearDown(self):
+        self.pool.remove()
+
+    def test_spill_agrees_with_add(self):
+        snapshot = SiteMapSnapshot(self.callbacks)
+        items = [snapshot.add(pair) for pair in self.callbacks.getSiteMap(None)]
+        expected = keys(TraceIndex(filter=ValueFilter(cap=0)).add(items))
+        spilled = SiteMapSnapshot(self.callbacks, shards=self.pool)
+        shards = [spilled.add(pair) for pair in self.callbacks.getSiteMap(None)]
+        self.assertGreater(len(self.pool.shards), 1)
+        for item, shard in zip(items, shards):
+            self.assertEqual(shard.message[shard.offset:], item.message[item.offset:])
+        index = TraceIndex(filter=ValueFilter(cap=0))
+        self.assertEqual(keys(index.spill(shards, self.pool)), expected)
+        self.assertEqual(len(index.scanned()), len(shards))
+        # Outputs added after the run are scanned in process, against every variant
+        shards.append(spilled.add(self.callbacks.sitemap[1]))
+        items.append(snapshot.add(self.callbacks.sitemap[1]))
+        self.assertEqual(keys(index.add(shards[-1:])), [key for key in keys(TraceIndex(filter=ValueFilter(cap=0)).add(items)) if key[0] == len(items) - 1 or key[2] == len(items) - 1])
+
+class TraceStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'trace.gz')
+        self.sitemap = generateSiteMap(30, bodySize=256, density=4.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def trace(self, sitemap, stopper=None):
+        snapshot = SiteMapSnapshot(FakeCallbacks(sitemap))
+        snapshot.capture(lambda *args: None)
+        index = TraceIndex(filter=ValueFilter(cap=0))
+        hits = index.add(snapshot.items, stopper, 1, stopper.stopping if stopper else None)
+        return snapshot, index, hits
+
+    def reload(self, sitemap):
+        # What a Load does: reuse the saved hits of unchanged items and scan the rest
+        items, found, unscanned = TraceStore.load(self.path)
+        snapshot = SiteMapSnapshot(FakeCallbacks(sitemap))
+        snapshot.capture(lambda *args: None)
+        restored, found, changed = TraceStore.reuse(snapshot, items, found, unscanned)
+        index = TraceIndex(filter=ValueFilter(cap=0))
+        hits = index.restore(restored, found) + index.add(changed)
+        return snapshot, restored, changed, hits
+
+    def test_round_trip(self):
+        snapshot, index, hits = self.trace(self.sitemap)
+        TraceStore.save(self.path, snapshot, index)
+        items, found, unscanned = TraceStore.load(self.path)
+        self.assertEqual([(item.service, item.url, item.method, item.parameters, item.scope, item.offset, item.digest, item.message) for item in items],
+                         [(item.service, item.url, item.method, item.parameters, item.scope, item.offset, item.digest, None) for item in snapshot.items])
+        self.assertEqual(sorted(found), sorted((variant, sitem.index, offset) for variant, hits in index.hits.items() for sitem, offset in hits))
+        self.assertEqual(unscanned, set())
+        snapshot, restored, changed, reloaded = self.reload(self.sitemap)
+        self.assertEqual((len(restored), changed), (len(self.sitemap), []))
+        self.assertEqual(keys(reloaded), keys(hits))
+
+    def test_stopped(self):
+        # Responses a stopped trace did not scan are flagged and scanned again on load
+        snapshot, index, hits = self.trace(self.sitemap, Stopper(10))
+        TraceStore.save(self.path, snapshot, index)
+        items, found, unscanned = TraceStore.load(self.path)
+        self.assertEqual(unscanned, set(range(len(index.scanned()), len(self.sitemap))))
+        snapshot, restored, changed, reloaded = self.reload(self.sitemap)
+        self.assertEqual([item.index for item in changed], sorted(unscanned))
+        self.assertEqual(keys(reloaded), keys(self.trace(self.sitemap)[2]))
+
+    def test_changed_and_removed(self):
+        snapshot, index, hits = self.trace(self.sitemap)
+        TraceStore.save(self.path, snapshot, index)
+        sitemap = list(self.sitemap[1:])
+        value = sitemap[1].request.split('p0=')[1].split('&')[0]
+        sitemap[0] = FakeHttpRequestResponse(sitemap[0].httpService, sitemap[0].request, sitemap[0].response + ' ' + value)
+        snapshot, restored, changed, reloaded = self.reload(sitemap)
+        self.assertEqual([item.url for item in changed], [snapshot.items[0].url])
+        # The removed item is kept after the current ones, along with its hits
+        self.assertEqual(len(snapshot.items), len(self.sitemap))
+        removed = snapshot.items[-1].url
+        self.assertEqual(removed, self.trace(self.sitemap)[0].items[0].url)
+        urls = lambda hits: sorted((item.url, param.name, sitem.url, offset, length, encoding) for item, param, sitem, offset, length, encoding in hits)
+        self.assertTrue(any(removed in hit for hit in urls(reloaded)))
+        self.assertEqual([hit for hit in urls(reloaded) if removed not in hit], urls(self.trace(sitemap)[2]))
+        body = snapshot.items[0].message[snapshot.items[0].offset:]
+        self.assertIn((snapshot.items[1].url, 'p0', snapshot.items[0].url, len(body) - len(value), len(value), Encodings.Raw), urls(reloaded))
+
+    def test_version_2(self):
+        snapshot, index, hits = self.trace(self.sitemap)
+        TraceStore.save(self.path, snapshot, index)
+        with gzip.open(self.path, 'rb') as f:
+            records = [json.loads(line.decode('utf-8')) for line in f]
+        self.assertEqual(records[0], ['tracer', TraceStore.VERSION])
+        # Version 2 items have no scanned flag, and count as scanned
+        records[0] = ['tracer', 2]
+        records = [record[:8] if record[0] == 'item' else record for record in records]
+        records[1].append(False)
+        with gzip.open(self.path, 'wb') as f:
+            for record in records:
+                TraceStore.write(f, record)
+        items, found, unscanned = TraceStore.load(self.path)
+        self.assertEqual((len(items), unscanned), (len(self.sitemap), set([0])))
+        records[1].pop()
+        with gzip.open(self.path, 'wb') as f:
+            for record in records:
+                TraceStore.write(f, record)
+        self.assertEqual(TraceStore.load(self.path)[2], set())
+        records[0] = ['tracer', 4]
+        with gzip.open(self.path, 'wb') as f:
+            for record in records:
+                TraceStore.write(f, record)
+        with self.assertRaises(ValueError):
+            TraceStore.load(self.path)
+
+class ContextsTest(unittest.TestCase):
+
+    def test_html(self):
+        self.assertEqual(runs('<p class="a b" id=x>hi <!-- c --> <b>t</b>'), [
+            ('tag', '<p class="'), ('attribute', 'a b'), ('tag', '" id='), ('attribute', 'x'), ('tag', '>'),
+            ('text', 'hi '), ('comment', '<!-- c -->'), ('text', ' '), ('tag', '<b>'), ('text', 't'), ('tag', '</b>'),
+        ])
+
+    def test_script_and_style(self):
+        self.assertEqual(runs('<script>var a = "<b>";</SCRIPT><style>p {}</style>'), [
+            ('tag', '<script>'), ('script', 'var a = "<b>";'), ('tag', '</SCRIPT><style>'), ('style', 'p {}'), ('tag', '</style>'),
+        ])
+
+    def test_json(self):
+        self.assertEqual(runs('HTTP/1.1 200 OK\r\n\r\n  {"a": "<b>"}', 19), [('json', '  {"a": "<b>"}')])
+
+    def test_unterminated(self):
+        self.assertEqual(runs('<a href="x'), [('tag', '<a href="'), ('attribute', 'x')])
+        self.assertEqual(runs('a <!-- b'), [('text', 'a '), ('comment', '<!-- b')])
+        self.assertEqual(runs('<script>x'), [('tag', '<script>'), ('script', 'x')])
+
+    def test_not_markup(self):
+        self.assertEqual(runs('1 < 2 <> 3'), [('text', '1 < 2 <> 3')])
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(text.encode('utf-8'))
+        return path
+
+    def har(self, count):
+        entries = list()
+        for index in range(count):
+            entries.append({
+                'request': {'method': 'GET', 'url': 'https://a.com/p{}?q=v{}'.format(index, index), 'headers': []},
+                'response': {'content': {'mimeType': 'text/html', 'text': '<p>v{}</p>'.format(index)}},
+            })
+        return json.dumps({'log': {'version': '1.2', 'entries': entries}})
+
+    def test_har_entries(self):
+        path = self.write('a.har', self.har(50))
+        chunk = HarEntries.CHUNK
+        HarEntries.CHUNK = 7
+        try:
+            entries = list(HarEntries(path))
+        finally:
+            HarEntries.CHUNK = chunk
+        self.assertEqual([entry['request']['url'] for entry in entries], ['https://a.com/p{}?q=v{}'.format(index, index) for index in range(50)])
+
+    def test_har_empty(self):
+        self.assertEqual(list(HarEntries(self.write('a.har', self.har(0)))), [])
+
+    def test_har_truncated(self):
+        text = self.har(3)
+        path = self.write('a.har', text[:len(text) // 2])
+        with self.assertRaises(ValueError) as raised:
+            list(HarEntries(path))
+        self.assertIn(path, str(raised.exception))
+        self.assertIn('character', str(raised.exception))
+
+    def test_har_without_entries(self):
+        with self.assertRaises(ValueError):
+            list(HarEntries(self.write('a.har', '{"log": {}}')))
+
+    def test_har_items(self):
+        items = list(ExportReader(self.write('a.har', self.har(2))).items())
+        self.assertEqual([(item.url, item.method, item.offset, item.message) for item in items], [
+            ('https://a.com/p0?q=v0', 'GET', 0, '<p>v0</p>'),
+            ('https://a.com/p1?q=v1', 'GET', 0, '<p>v1</p>'),
+        ])
+        self.assertEqual([(param.name, param.value) for param in items[0].parameters], [('q', 'v0')])
+
+    def test_xml_items(self):
+        def encoded(text):
+            return base64.b64encode(text.encode('latin-1')).decode('ascii')
+        request = 'POST /login?next=%2Fhome HTTP/1.1\r\nHost: a.com\r\nContent-Type: application/x-www-form-urlencoded\r\n\r\nuser=alice'
+        response = 'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n<p>alice \xe9</p>'
+        path = self.write('a.xml', (
+            '<?xml version="1.0"?><items burpVersion="2">'
+            '<item><url><![CDATA[https://a.com/login?next=%2Fhome]]></url><host ip="1.1.1.1">a.com</host><port>443</port>'
+            '<protocol>https</protocol><method>POST</method><mimetype>HTML</mimetype>'
+            '<request base64="true"><![CDATA[{}]]></request><response base64="true"><![CDATA[{}]]></response></item>'
+            '<item><url><![CDATA[https://a.com/img.png]]></url><host ip="1.1.1.1">a.com</host><port>443</port>'
+            '<protocol>https</protocol><method>GET</method><mimetype>PNG</mimetype>'
+            '<request base64="false"><![CDATA[GET /img.png HTTP/1.1\r\n\r\n]]></request><response base64="false"><![CDATA[HTTP/1.1 200 OK\r\n\r\nPNG]]></response></item>'
+            '</items>'
+        ).format(encoded(request), encoded(response)))
+        items = list(ExportReader(path, ['/login']).items())
+        self.assertEqual(len(items), 2)
+        login, image = items
+        self.assertEqual((login.service.protocol, login.service.host, login.service.port), ('https', 'a.com', 443))
+        self.assertEqual((login.method, login.scope), ('POST', True))
+        self.assertEqual(sorted((param.name, param.value) for param in login.parameters), [('next', '%2Fhome'), ('user', 'alice')])
+        self.assertEqual(login.message[login.offset:], '<p>alice \xe9</p>')
+        # Out of scope, and a skipped MIME type besides
+        self.assertEqual((image.scope, image.message), (False, None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,30 +1,68 @@
 from burp import IBurpExtender
+from burp import IExtensionStateListener
+from burp import IHttpListener
 from burp import IParameter
 from burp import ITab
 from java.awt import BorderLayout
 from java.awt import Color
+from java.awt import FlowLayout
 from java.awt import Font
 from java.awt import GridLayout
 from java.awt.event import ActionListener
+from java.io import File
 from java.lang import Runnable
+from java.lang import Runtime
 from java.lang import Thread
 from java.net import URL
+from java.util.concurrent import Executors
 from javax.swing import BorderFactory
 from javax.swing import ButtonGroup
 from javax.swing import JButton
+from javax.swing import JCheckBox
+from javax.swing import JFileChooser
 from javax.swing import JLabel
 from javax.swing import JOptionPane
 from javax.swing import JPanel
 from javax.swing import JProgressBar
+from javax.swing import JRadioButton
 from javax.swing import JScrollPane
+from javax.swing import JSpinner
+from javax.swing import JTextField
+from javax.swing import JTextArea
+from javax.swing import JToggleButton
 from javax.swing import JTree
+from javax.swing import SpinnerNumberModel
+from javax.swing import SwingUtilities
+from javax.swing import Timer
 from javax.swing.border import EmptyBorder
+from javax.swing.event import ChangeListener
+from javax.swing.event import DocumentListener
+from javax.swing.filechooser import FileNameExtensionFilter
+from javax.swing.event import TreeExpansionListener
 from javax.swing.event import TreeModelEvent
+from javax.swing.event import TreeModelListener
 from javax.swing.tree import TreeModel
+from javax.swing.tree import TreePath
 from jarray import array
 
+from tracer_engine import ContextClassifier
+from tracer_engine import EdgeIndex
+from tracer_engine import LRUCache
+from tracer_engine import ResponseFilter
+from tracer_engine import ShardPool
+from tracer_engine import SiteMapSnapshot
+from tracer_engine import TraceIndex
+from tracer_engine import TraceStats
+from tracer_engine import TraceStore
+from tracer_engine import ValueFilter
+from tracer_engine import excerpt
+from tracer_engine import openEdgeWriter
+
+import collections
 import json
-import re
+import os
+import threading
+import time
 import urlparse
 
 class Fonts:
@@ -40,216 +78,523 @@ class Mode:
     InputToOutput = 0
     OutputToInput = 1
 
-class NodeService:
+class NodeChildren(object):
+    """Ordered, key-indexed list of child nodes."""
 
-    def __init__(self, callbacks, service):
-        self.callbacks = callbacks
-        self.service = service
-        self.protocol = service.protocol
-        self.host = service.host
-        self.port = service.port
-        self.endpoints = list()
+    __slots__ = ('nodes', 'indices')
 
-    def __eq__(self, other):
-        return self.__class__ == other.__class__ and self.host == other.host and self.port == other.port and self.protocol == other.protocol
+    def __init__(self):
+        self.nodes = list()
+        self.indices = dict()
 
-    def __str__(self):
-        return '{}://{}:{}'.format(self.protocol, self.host, self.port)
+    def add(self, node):
+        """Appends node unless an equal node exists; returns the installed node."""
+        index = self.indices.get(node.key)
+        if index is not None:
+            return self.nodes[index]
+        self.indices[node.key] = len(self.nodes)
+        self.nodes.append(node)
+        return node
 
-    def __hash__(self):
-        return str(self).__hash__()
+    def get(self, key):
+        index = self.indices.get(key)
+        return self.nodes[index] if index is not None else None
 
-    def __repr__(self):
-        return str(self)
+    def index(self, node):
+        """Returns the position of node, or -1 if it is not a child."""
+        return self.indices.get(getattr(node, 'key', None), -1)
 
-class NodeEndpoint:
+    def __getitem__(self, index):
+        return self.nodes[index]
 
-    def __init__(self, callbacks, url):
-        self.callbacks = callbacks
-        parsed = urlparse.urlparse(str(url))
-        self.url = '{}://{}{}'.format(parsed.scheme, parsed.netloc, parsed.path)
-        self.requests = list()
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __contains__(self, node):
+        return getattr(node, 'key', None) in self.indices
+
+# Shared child list of nodes that have no children yet; never added to
+NodeChildren.EMPTY = NodeChildren()
+
+class Node(object):
+    """Base of the compact tree nodes.
+
+    Nodes are slotted and hold only their key, their children and, for
+    excerpts, the record of a site map item; they never keep Burp objects
+    alive. A node has a child list for each mode it can appear in, and each
+    is only created when its first child is added.
+    """
+
+    __slots__ = ()
 
     def __eq__(self, other):
-        return self.__class__ == other.__class__ and self.url == other.url
+        return self.__class__ == other.__class__ and self.key == other.key
 
-    def __str__(self):
-        return self.url
+    def __ne__(self, other):
+        return not self == other
 
     def __hash__(self):
-        return str(self).__hash__()
+        return hash(self.key)
+
+class NodeService(Node):
+
+    __slots__ = ('key', 'endpoints')
+
+    def __init__(self, service):
+        self.key = (service.protocol, service.host, service.port)
+        self.endpoints = None
+
+    def __str__(self):
+        return '{}://{}:{}'.format(*self.key)
 
     def __repr__(self):
-        return urlparse.urlparse(self.url).path
+        return str(self)
 
-class NodeRequest:
+class NodeEndpoint(Node):
 
-    def __init__(self, callbacks, request):
-        self.callbacks = callbacks
-        self.request = request
-        self.parameters = list()
-        self.dict = dict()
-        for p in self.request.parameters:
-            self.dict[p.name] = p.value
+    __slots__ = ('key', 'requests')
 
-    def __dict__(self):
-        return self.dict
+    def __init__(self, url):
+        parsed = urlparse.urlparse(url)
+        self.key = '{}://{}{}'.format(parsed.scheme, parsed.netloc, parsed.path)
+        self.requests = None
 
-    def __eq__(self, other):
-        return self.__class__ == other.__class__ and self.request.method == other.request.method and self.request.url == other.request.url and self.dict == other.dict
+    @property
+    def url(self):
+        return self.key
 
     def __str__(self):
-        return '{} {} ({})'.format(self.request.method, self.request.url, json.dumps(self.dict, sort_keys=True))
-
-    def __hash__(self):
-        return str(self).__hash__()
+        return self.key
 
     def __repr__(self):
-        return '{}: {}'.format(self.request.method, json.dumps(self.dict, sort_keys=True))
+        return urlparse.urlparse(self.key).path
 
-class NodeParameter:
+class NodeRequest(Node):
 
-    def __init__(self, callbacks, name, value):
-        self.callbacks = callbacks
-        self.name = name
-        self.value = value
-        self.references = list()
+    __slots__ = ('key', 'parameters')
 
-    def __eq__(self, other):
-        return self.__class__ == other.__class__ and self.name == other.name and self.value == other.value
+    def __init__(self, item):
+        self.key = (item.method, item.url, tuple(sorted(dict((param.name, param.value) for param in item.parameters).items())))
+        self.parameters = None
 
     def __str__(self):
-        return '{}: {}'.format(self.name, self.value)
+        method, url, parameters = self.key
+        return '{} {} ({})'.format(method, url, json.dumps(dict(parameters), sort_keys=True))
 
-    def __hash__(self):
-        return str(self).__hash__()
+    def __repr__(self):
+        method, url, parameters = self.key
+        return '{}: {}'.format(method, json.dumps(dict(parameters), sort_keys=True))
+
+class NodeParameter(Node):
+
+    __slots__ = ('key', 'references', 'excerpts')
+
+    def __init__(self, name, value):
+        self.key = (name, value)
+        self.references = None
+        self.excerpts = None
+
+    @property
+    def name(self):
+        return self.key[0]
+
+    @property
+    def value(self):
+        return self.key[1]
+
+    def __str__(self):
+        return '{}: {}'.format(*self.key)
 
     def __repr__(self):
         return str(self)
 
 class NodeReferenceService(NodeService):
-    pass
+
+    __slots__ = ()
 
 class NodeReferenceEndpoint(NodeEndpoint):
-    pass
+
+    __slots__ = ()
 
 class NodeReferenceRequest(NodeRequest):
 
-    def __init__(self, callbacks, request):
-        NodeRequest.__init__(self, callbacks, request)
-        self.excerpts = list()
+    __slots__ = ('excerpts', 'references')
+
+    def __init__(self, item):
+        NodeRequest.__init__(self, item)
+        self.excerpts = None
+        self.references = None
+
+class NodeExcerpt(Node):
+    """A match inside a response body, rendered into a preview only when displayed.
 
-class NodeExcerpt:
+    Its context is also only worked out when displayed; the first excerpt of
+    a response to be displayed tokenizes the body for all the others.
+    """
 
     EXTRA_LEFT = 20
     EXTRA_RIGHT = 20
+    PREVIEWS = LRUCache(4096)
+    CONTEXTS = ContextClassifier(256)
 
-    def __init__(self, callbacks, offset, length, body):
-        self.callbacks = callbacks
+    __slots__ = ('response', 'offset', 'length', 'encoding')
+
+    def __init__(self, response, offset, length, encoding):
+        self.response = response
         self.offset = offset
         self.length = length
-        self.data = body[offset:offset+length]
-        start = max(0, offset - NodeExcerpt.EXTRA_LEFT)
-        end = min(len(body), offset + length + NodeExcerpt.EXTRA_RIGHT)
-        self.preview = '{}{}{}'.format('...' if start > 0 else '', body[start:end], '...' if end < len(body) else '')
-
-    def __eq__(self, other):
-        return self.__class__ == other.__class__ and self.offset == other.offset and self.length == other.length and self.data == other.data
+        self.encoding = encoding
+
+    @property
+    def key(self):
+        return (self.offset, self.length)
+
+    @property
+    def data(self):
+        if self.response.message is None:
+            return None
+        start = self.response.offset + self.offset
+        return self.response.message[start:start+self.length]
+
+    @property
+    def preview(self):
+        if self.response.message is None:
+            return '(response no longer in site map)'
+        key = (self.response.index, self.offset, self.length)
+        preview = NodeExcerpt.PREVIEWS.get(key)
+        if preview is None:
+            preview = excerpt(self.response.message, self.offset, self.length, NodeExcerpt.EXTRA_LEFT, NodeExcerpt.EXTRA_RIGHT, self.response.offset)
+            NodeExcerpt.PREVIEWS.put(key, preview)
+        return preview
+
+    @property
+    def context(self):
+        return NodeExcerpt.CONTEXTS.label(self.response, self.offset)
 
     def __str__(self):
-        return 'Offset: {}; Length: {}; Data: "{}"'.format(self.offset, self.length, self.preview)
-
-    def __hash__(self):
-        return str(self).__hash__()
+        return 'Offset: {}; Length: {}; Encoding: {}; Context: {}; Data: "{}"'.format(self.offset, self.length, self.encoding, self.context or 'unknown', self.preview)
 
     def __repr__(self):
         return str(self)
 
+class Projection(object):
+    """Nodes of the edges that match terms, arranged for mode under root.
+
+    covered counts the edges projected so far, so that a projection that was
+    built off the EDT or set aside can catch up with edges added since. Once
+    shown, a projection is only touched on the EDT.
+    """
+
+    __slots__ = ('root', 'mode', 'terms', 'services', 'covered')
+
+    def __init__(self, root, mode, terms):
+        self.root = root
+        self.mode = mode
+        self.terms = terms
+        self.services = NodeChildren()
+        self.covered = 0
+
+    def children(self, parent):
+        if parent is self.root:
+            return self.services
+        name = TracerTreeModel.CHILDREN[self.mode].get(parent.__class__)
+        if name is None:
+            return None
+        children = getattr(parent, name)
+        return children if children is not None else NodeChildren.EMPTY
+
+    def container(self, parent):
+        # Returns the child list of parent to add to, creating it on the first add
+        if parent is self.root:
+            return self.services
+        name = TracerTreeModel.CHILDREN[self.mode][parent.__class__]
+        children = getattr(parent, name)
+        if children is None:
+            children = NodeChildren()
+            setattr(parent, name, children)
+        return children
+
+    def project(self, item, param, sitem):
+        # Installs every level above the excerpt and returns its path and topmost new node
+        if self.mode == Mode.InputToOutput:
+            nodes = [
+                NodeService(item.service),
+                NodeEndpoint(item.url),
+                NodeRequest(item),
+                NodeParameter(param.name, param.value),
+                NodeReferenceService(sitem.service),
+                NodeReferenceEndpoint(sitem.url),
+                NodeReferenceRequest(sitem),
+            ]
+        else:
+            nodes = [
+                NodeReferenceService(sitem.service),
+                NodeReferenceEndpoint(sitem.url),
+                NodeReferenceRequest(sitem),
+                NodeService(item.service),
+                NodeEndpoint(item.url),
+                NodeRequest(item),
+                NodeParameter(param.name, param.value),
+            ]
+        path = [self.root]
+        created = None
+        for node in nodes:
+            children = self.container(path[-1])
+            child = children.add(node)
+            if created is None and child is node:
+                created = (list(path), len(children) - 1, node)
+            path.append(child)
+        return path, created
+
+    def extend(self, edges, numbers=None):
+        """Projects the given edges, or else every edge not covered yet that matches the terms."""
+        if numbers is None:
+            numbers = [number for number in range(self.covered, len(edges)) if not self.terms or EdgeIndex.matches(self.terms, *edges[number][:3])]
+            self.covered = len(edges)
+        for number in numbers:
+            item, param, sitem, offset, length, encoding = edges[number]
+            path, created = self.project(item, param, sitem)
+            self.container(path[-1]).add(NodeExcerpt(sitem, offset, length, encoding))
+
+class ProjectRunnable(Runnable):
+    """Builds a projection off the EDT and hands it to the model to show."""
+
+    def __init__(self, model, projection, edges, numbers, generation):
+        self.model = model
+        self.projection = projection
+        self.edges = edges
+        self.numbers = numbers
+        self.generation = generation
+
+    def run(self):
+        self.projection.extend(self.edges, self.numbers)
+        SwingUtilities.invokeLater(SwingRunnable(self.model.present, self.projection, self.generation))
+
 class TracerTreeModel(TreeModel):
+    """Tree of hits, projected from the edge list in the current mode.
+
+    Nodes are only created and read on the EDT; tracing threads hand their
+    hits over in batches of BATCH, which are announced as insertions. Filtered
+    and re-moded projections are built off the EDT and swapped in, and the
+    unfiltered projection of each mode is kept, so that clearing the filter
+    only projects the edges added since it was last shown.
+    """
+
+    BATCH = 512
+
+    # Attribute holding the child list of each node type, per mode
+    CHILDREN = {
+        Mode.InputToOutput: {
+            NodeService: 'endpoints',
+            NodeEndpoint: 'requests',
+            NodeRequest: 'parameters',
+            NodeParameter: 'references',
+            NodeReferenceService: 'endpoints',
+            NodeReferenceEndpoint: 'requests',
+            NodeReferenceRequest: 'excerpts',
+        },
+        Mode.OutputToInput: {
+            NodeReferenceService: 'endpoints',
+            NodeReferenceEndpoint: 'requests',
+            NodeReferenceRequest: 'references',
+            NodeService: 'endpoints',
+            NodeEndpoint: 'requests',
+            NodeRequest: 'parameters',
+            NodeParameter: 'excerpts',
+        },
+    }
 
     def __init__(self, extender, callbacks):
         self.extender = extender
         self.callbacks = callbacks
-        self.services = list()
         self.listeners = list()
+        self.mode = Mode.InputToOutput
+        self.edges = list()
+        self.filters = EdgeIndex()
+        self.terms = list()
+        self.projection = Projection(self, self.mode, self.terms)
+        self.unfiltered = {self.mode: self.projection}
+        self.generation = 0
+        self.stats = TraceStats()
+        self.snapshot = SiteMapSnapshot(callbacks, URL, self.stats, self.extender.responseFilter)
+        self.index = TraceIndex(self.stats, self.extender.valueFilter)
+        self.pool = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def install(self, item, param, sitem, offset, length, encoding):
+        # Installs an edge and returns (path, index, node) for its topmost new node, or None
+        self.edges.append((item, param, sitem, offset, length, encoding))
+        self.filters.add(len(self.edges) - 1, item, param, sitem)
+        # The shown projection always covers every edge
+        projection = self.projection
+        projection.covered = len(self.edges)
+        if projection.terms and not EdgeIndex.matches(projection.terms, item, param, sitem):
+            return None
+        start = time.time()
+        path, created = projection.project(item, param, sitem)
+        projected = time.time()
+        excerpts = projection.container(path[-1])
+        excerpt = NodeExcerpt(sitem, offset, length, encoding)
+        if excerpts.add(excerpt) is excerpt:
+            self.stats.count('excerpts')
+            if created is None:
+                created = (path, len(excerpts) - 1, excerpt)
+        self.stats.time('dedup', projected - start)
+        self.stats.time('excerpts', time.time() - projected)
+        return created
+
+    def insert(self, hits):
+        # Installs a batch of hits on the EDT and announces only the topmost new nodes,
+        # since the tree discovers anything below them when it expands them
+        inserted = collections.OrderedDict()
+        fresh = set()
+        for hit in hits:
+            created = self.install(*hit)
+            if created is None:
+                continue
+            path, index, node = created
+            fresh.add(id(node))
+            if any(id(ancestor) in fresh for ancestor in path):
+                continue
+            inserted.setdefault(id(path[-1]), (path, list(), list()))
+            inserted[id(path[-1])][1].append(index)
+            inserted[id(path[-1])][2].append(node)
+        for path, indices, children in inserted.values():
+            event = TreeModelEvent(self, path, array(indices, 'i'), children)
+            for listener in self.listeners:
+                listener.treeNodesInserted(event)
+
+    def publish(self, hits):
+        # Hand hits over to the EDT in batches, so that the tree grows while tracing
+        for start in range(0, len(hits), TracerTreeModel.BATCH):
+            SwingUtilities.invokeAndWait(SwingRunnable(self.insert, hits[start:start + TracerTreeModel.BATCH]))
+
+    def reset(self):
+        self.edges = list()
+        self.filters = EdgeIndex()
+        self.generation += 1
+        self.projection = Projection(self, self.mode, self.terms)
+        self.unfiltered = dict()
+        if not self.terms:
+            self.unfiltered[self.mode] = self.projection
+        NodeExcerpt.PREVIEWS.clear()
+        NodeExcerpt.CONTEXTS.clear()
+        self.changed()
+
+    def reproject(self, mode):
+        # Runs on the EDT; only the indexed search happens here, the nodes are built off it
+        self.mode = mode
+        self.generation += 1
+        if not self.terms and mode in self.unfiltered:
+            self.present(self.unfiltered[mode], self.generation)
+            return
+        projection = Projection(self, mode, self.terms)
+        projection.covered = len(self.edges)
+        numbers = self.filters.search(self.terms) if self.terms else range(len(self.edges))
+        thread = Thread(ProjectRunnable(self, projection, self.edges, numbers, self.generation))
+        thread.start()
+
+    def present(self, projection, generation):
+        # Shows a projection once it has caught up, unless a later one was asked for
+        if generation != self.generation:
+            return
+        projection.extend(self.edges)
+        if not projection.terms:
+            self.unfiltered[projection.mode] = projection
+        self.projection = projection
+        self.changed()
+
+    def setFilter(self, query):
+        # Runs on the EDT, which owns the nodes, so it does not need the lock
+        terms = EdgeIndex.parse(query)
+        if terms != self.terms:
+            self.terms = terms
+            self.reproject(self.mode)
+
+    def setMode(self, mode):
+        # Runs on the EDT like setFilter, so it never waits for a trace
+        if mode != self.mode:
+            self.reproject(mode)
+
+    def progressOutput(self, sitem, current, maximum):
+        self.extender.progressCallbackOutput('Inspecting Outputs', current, maximum, sitem.url)
+
+    def progressShard(self, shard, current, maximum):
+        self.extender.progressCallbackOutput('Inspecting Shards', current, maximum, os.path.basename(shard))
+
+    def stop(self):
+        self.stopping.set()
 
     def refresh(self):
-        self.services = list()
-        sitemap = self.callbacks.getSiteMap(None)
-        inputs = 0
-        self.extender.progressCallbackInput('Ready', inputs, len(sitemap))
-        for pair in sitemap:
-            # Compute session
-            rq = self.callbacks.helpers.analyzeRequest(pair.httpService, pair.request)
-            rp = self.callbacks.helpers.analyzeRequest(pair.response) if pair.response else None
-            if self.callbacks.isInScope(URL(str(rq.url))) and rq.parameters:
-                # Compute service
-                service = NodeService(self.callbacks, pair.httpService)
-                service = self.services[self.services.index(service)] if service in self.services else service
-                # Compute endpoint
-                endpoint = NodeEndpoint(self.callbacks, rq.url)
-                endpoint = service.endpoints[service.endpoints.index(endpoint)] if endpoint in service.endpoints else endpoint
-                # Compute request
-                request = NodeRequest(self.callbacks, rq)
-                request = endpoint.requests[endpoint.requests.index(request)] if request in endpoint.requests else request
-                # Compute references
-                outputs = 0
-                self.extender.progressCallbackOutput('Ready', outputs, len(sitemap))
-                for spair in sitemap:
-                    # Compute subsession
-                    srq = self.callbacks.helpers.analyzeRequest(spair.httpService, spair.request)
-                    srp = self.callbacks.helpers.analyzeResponse(spair.response) if spair.response else None
-                    if srp and self.callbacks.isInScope(URL(str(srq.url))):
-                        # Look for parameters in body
-                        body = spair.response.tostring()[srp.bodyOffset:]
-                        for param in rq.parameters:
-                            # Skip if not found
-                            if param.value and param.value in body:
-                                # Compute parameter
-                                parameter = NodeParameter(self.callbacks, param.name, param.value)
-                                parameter = request.parameters[request.parameters.index(parameter)] if parameter in request.parameters else parameter
-                                # Compute referenced service
-                                rservice = NodeReferenceService(self.callbacks, spair.httpService)
-                                rservice = parameter.references[parameter.references.index(rservice)] if rservice in parameter.references else rservice
-                                # Compute referenced endpoint
-                                rendpoint = NodeReferenceEndpoint(self.callbacks, srq.url)
-                                rendpoint = rservice.endpoints[rservice.endpoints.index(rendpoint)] if rendpoint in rservice.endpoints else rendpoint
-                                # Compute referenced request
-                                rrequest = NodeReferenceRequest(self.callbacks, srq)
-                                rrequest = rendpoint.requests[rendpoint.requests.index(rrequest)] if rrequest in rendpoint.requests else rrequest
-                                # Iterate over all excerpts
-                                for match in re.finditer(re.escape(param.value), body):
-                                    # Compute excerpt
-                                    excerpt = NodeExcerpt(self.callbacks, match.start(), len(param.value), body)
-                                    excerpt = rrequest.excerpts[rrequest.excerpts.index(excerpt)] if excerpt in rrequest.excerpts else excerpt
-                                    # Install service
-                                    if service not in self.services:
-                                        self.services.append(service)
-                                    # Install endpoint
-                                    if endpoint not in service.endpoints:
-                                        service.endpoints.append(endpoint)
-                                    # Install request
-                                    if request not in endpoint.requests:
-                                        endpoint.requests.append(request)
-                                    # Install parameter
-                                    if parameter not in request.parameters:
-                                        request.parameters.append(parameter)
-                                    # Install referenced service
-                                    if rservice not in parameter.references:
-                                        parameter.references.append(rservice)
-                                    # Install referenced endpoint
-                                    if rendpoint not in rservice.endpoints:
-                                        rservice.endpoints.append(rendpoint)
-                                    # Install referenced request
-                                    if rrequest not in rendpoint.requests:
-                                        rendpoint.requests.append(rrequest)
-                                    # Install excerpt
-                                    if excerpt not in rrequest.excerpts:
-                                        rrequest.excerpts.append(excerpt)
-                    outputs += 1
-                    self.extender.progressCallbackOutput('Inspecting Outputs [{}/{}]: {}'.format(outputs, len(sitemap), URL(str(srq.url))), outputs, len(sitemap))
-            inputs += 1
-            self.extender.progressCallbackInput('Inspecting Inputs [{}/{}]: {}'.format(inputs, len(sitemap), URL(str(rq.url))), inputs, len(sitemap))
+        with self.lock:
+            self.stopping.clear()
+            SwingUtilities.invokeAndWait(SwingRunnable(self.reset))
+            self.close()
+            # Spill bodies to shards for worker processes, if enabled
+            if self.extender.shardSize:
+                self.pool = ShardPool(self.extender.shardSize << 20, self.extender.python, self.extender.threads)
+            # Snapshot site map
+            self.stats = TraceStats()
+            self.snapshot = SiteMapSnapshot(self.callbacks, URL, self.stats, self.extender.responseFilter, self.pool)
+            self.snapshot.capture(self.extender.progressCallbackInput, self.stopping)
+            # Scan each output exactly once, publishing hits batch by batch
+            self.index = TraceIndex(self.stats, self.extender.valueFilter)
+            self.extender.progressCallbackOutput('Ready', 0, 1)
+            if self.pool is not None:
+                self.index.spill(self.snapshot.items, self.pool, self.progressShard, self.stopping, self.publish)
+            else:
+                self.index.add(self.snapshot.items, self.progressOutput, self.extender.threads, self.stopping, self.publish)
+        self.extender.statsCallback(self.stats)
+
+    def save(self, path):
+        with self.lock:
+            TraceStore.save(path, self.snapshot, self.index)
+
+    def export(self, path, format):
+        # Stream the edges straight to the file, one record at a time
+        with self.lock:
+            f, writer = openEdgeWriter(path, format)
+            with f:
+                # Tokenize each body once for all of its hits, in a single pass
+                for edge, context in zip(self.edges, ContextClassifier.classify(self.edges)):
+                    writer.write(*edge, context=context)
+
+    def load(self, path):
+        items, found, unscanned = TraceStore.load(path)
+        with self.lock:
+            self.stopping.clear()
+            SwingUtilities.invokeAndWait(SwingRunnable(self.reset))
+            self.close()
+            # Snapshot site map
+            self.stats = TraceStats()
+            self.snapshot = SiteMapSnapshot(self.callbacks, URL, self.stats, self.extender.responseFilter)
+            self.snapshot.capture(self.extender.progressCallbackInput, self.stopping)
+            # Match saved items to current items by content; unscanned ones are scanned again
+            restored, found, changed = TraceStore.reuse(self.snapshot, items, found, unscanned)
+            # Reuse saved hits and scan only what changed
+            self.index = TraceIndex(self.stats, self.extender.valueFilter)
+            self.extender.progressCallbackOutput('Ready', 0, 1)
+            self.publish(self.index.restore(restored, found))
+            self.index.add(changed, self.progressOutput, self.extender.threads, self.stopping, self.publish)
+        self.extender.statsCallback(self.stats)
+
+    def trace(self, pairs):
+        # One add for the whole batch, so that existing outputs are searched once for all new values
+        with self.lock:
+            items = [self.snapshot.add(pair) for pair in pairs]
+            self.index.add(items, None, self.extender.threads, None, self.publish)
+
+    def close(self):
+        # Remove the shards of the previous run; its nodes must already be gone
+        if self.pool is not None:
+            self.pool.remove()
+            self.pool = None
+
+    def changed(self):
         # Render tree
         for listener in self.listeners:
             listener.treeStructureChanged(TreeModelEvent(self, [self]))
@@ -257,43 +602,16 @@ class TracerTreeModel(TreeModel):
     def getRoot(self):
         return self
 
+    def children(self, parent):
+        return self.projection.children(parent)
+
     def getChild(self, parent, index):
-        if parent is self:
-            return parent.services[index]
-        if parent.__class__ == NodeService:
-            return parent.endpoints[index]
-        if parent.__class__ == NodeEndpoint:
-            return parent.requests[index]
-        if parent.__class__ == NodeRequest:
-            return parent.parameters[index]
-        if parent.__class__ == NodeParameter:
-            return parent.references[index]
-        if parent.__class__ == NodeReferenceService:
-            return parent.endpoints[index]
-        if parent.__class__ == NodeReferenceEndpoint:
-            return parent.requests[index]
-        if parent.__class__ == NodeReferenceRequest:
-            return parent.excerpts[index]
-        return None
+        children = self.children(parent)
+        return children[index] if children is not None else None
 
     def getChildCount(self, parent):
-        if parent is self:
-            return len(parent.services)
-        if parent.__class__ == NodeService:
-            return len(parent.endpoints)
-        if parent.__class__ == NodeEndpoint:
-            return len(parent.requests)
-        if parent.__class__ == NodeRequest:
-            return len(parent.parameters)
-        if parent.__class__ == NodeParameter:
-            return len(parent.references)
-        if parent.__class__ == NodeReferenceService:
-            return len(parent.endpoints)
-        if parent.__class__ == NodeReferenceEndpoint:
-            return len(parent.requests)
-        if parent.__class__ == NodeReferenceRequest:
-            return len(parent.excerpts)
-        return 0
+        children = self.children(parent)
+        return len(children) if children is not None else 0
 
     def isLeaf(self, node):
         return self.getChildCount(node) <= 0
@@ -302,23 +620,8 @@ class TracerTreeModel(TreeModel):
         pass
 
     def getIndexOfChild(self, parent, child):
-        if parent is self:
-            return parent.services.index(child)
-        if parent.__class__ == NodeService:
-            return parent.endpoints.index(child)
-        if parent.__class__ == NodeEndpoint:
-            return parent.requests.index(child)
-        if parent.__class__ == NodeRequest:
-            return parent.parameters.index(child)
-        if parent.__class__ == NodeParameter:
-            return parent.references.index(child)
-        if parent.__class__ == NodeReferenceService:
-            return parent.endpoints.index(child)
-        if parent.__class__ == NodeReferenceEndpoint:
-            return parent.requests.index(child)
-        if parent.__class__ == NodeReferenceRequest:
-            return parent.excerpts.index(child)
-        return 0
+        children = self.children(parent)
+        return children.index(child) if children is not None else -1
 
     def addTreeModelListener(self, listener):
         self.listeners.append(listener)
@@ -332,18 +635,96 @@ class TracerTreeModel(TreeModel):
     def __repr__(self):
         return str(self)
 
+class ExpansionListener(TreeExpansionListener, TreeModelListener):
+    """Remembers expanded paths and re-expands them as equal nodes reappear.
+
+    Nodes compare by key, so a path expanded before a refresh or load still
+    matches the nodes that replace it. The hidden root is expanded whenever it
+    gains children: JTree only expands it if it already had children when the
+    structure last changed, which is never the case after a reset.
+    """
+
+    def __init__(self, tree):
+        super(ExpansionListener, self).__init__()
+        self.tree = tree
+        self.expanded = set()
+
+    def treeExpanded(self, event):
+        self.expanded.add(event.path)
+
+    def treeCollapsed(self, event):
+        self.expanded.discard(event.path)
+
+    def treeNodesInserted(self, event):
+        if event.treePath.pathCount == 1:
+            self.tree.expandPath(event.treePath)
+        for child in event.children:
+            self.restore(event.treePath.pathByAddingChild(child))
+
+    def treeStructureChanged(self, event):
+        model = self.tree.model
+        if model.getChildCount(model.root):
+            self.tree.expandPath(TreePath(model.root))
+        for index in range(model.getChildCount(model.root)):
+            self.restore(TreePath([model.root, model.getChild(model.root, index)]))
+
+    def treeNodesChanged(self, event):
+        pass
+
+    def treeNodesRemoved(self, event):
+        pass
+
+    def restore(self, path):
+        # Leave paths under a collapsed parent alone, as expandPath would open the parent too
+        if path not in self.expanded:
+            return
+        if path.parentPath.pathCount > 1 and not self.tree.isExpanded(path.parentPath):
+            return
+        self.tree.expandPath(path)
+        model = self.tree.model
+        node = path.lastPathComponent
+        for index in range(model.getChildCount(node)):
+            self.restore(path.pathByAddingChild(model.getChild(node, index)))
+
 class ResultTree(JTree):
     
     def __init__(self, extender):
         super(ResultTree, self).__init__()
         self.extender = extender
         self.rootVisible = False
+        self.expansion = ExpansionListener(self)
+        self.addTreeExpansionListener(self.expansion)
         
     def refresh(self):
         self.model.refresh()
 
+    def trace(self, pairs):
+        self.model.trace(pairs)
+
+    def save(self, path):
+        self.model.save(path)
+
+    def export(self, path, format):
+        self.model.export(path, format)
+
+    def setMode(self, mode):
+        self.model.setMode(mode)
+
+    def setFilter(self, query):
+        self.model.setFilter(query)
+
+    def stop(self):
+        self.model.stop()
+
+    def load(self, path):
+        self.model.load(path)
+
+    def close(self):
+        self.model.close()
+
     def registerExtenderCallbacks(self, callbacks):
         self.model = TracerTreeModel(self.extender, callbacks)
+        self.model.addTreeModelListener(self.expansion)
 
 class TitlePanel(JPanel):
 
@@ -380,6 +761,126 @@ class StartActionListener(ActionListener):
     def actionPerformed(self, event):
         self.extender.refresh()
 
+class StopActionListener(ActionListener):
+
+    def __init__(self, extender):
+        super(StopActionListener, self).__init__()
+        self.extender = extender
+
+    def actionPerformed(self, event):
+        self.extender.stop()
+
+class LiveActionListener(ActionListener):
+
+    def __init__(self, extender):
+        super(LiveActionListener, self).__init__()
+        self.extender = extender
+
+    def actionPerformed(self, event):
+        self.extender.live = event.source.selected
+
+class ThreadsChangeListener(ChangeListener):
+
+    def __init__(self, extender):
+        super(ThreadsChangeListener, self).__init__()
+        self.extender = extender
+
+    def stateChanged(self, event):
+        self.extender.threads = event.source.value
+
+class FiltersActionListener(ActionListener):
+
+    def __init__(self, extender):
+        super(FiltersActionListener, self).__init__()
+        self.extender = extender
+
+    def actionPerformed(self, event):
+        values = self.extender.valueFilter
+        responses = self.extender.responseFilter
+        minimum = JSpinner(SpinnerNumberModel(values.minimum, 1, 1024, 1))
+        numbers = JCheckBox('Skip numbers', values.numbers)
+        booleans = JCheckBox('Skip true/false, yes/no, on/off, null', values.booleans)
+        cap = JSpinner(SpinnerNumberModel(values.cap, 0, 1000000, 10))
+        maximum = JSpinner(SpinnerNumberModel(responses.maximum >> 10, 0, 1 << 20, 256))
+        mimeTypes = JTextField(', '.join(sorted(responses.mimeTypes)))
+        shardSize = JSpinner(SpinnerNumberModel(self.extender.shardSize, 0, 1 << 14, 16))
+        python = JTextField(self.extender.python)
+        panel = JPanel(GridLayout(8, 2))
+        panel.add(JLabel('Minimum value length'))
+        panel.add(minimum)
+        panel.add(numbers)
+        panel.add(JLabel())
+        panel.add(booleans)
+        panel.add(JLabel())
+        panel.add(JLabel('Hits per value (0: no cap)'))
+        panel.add(cap)
+        panel.add(JLabel('Maximum body size in KB (0: no limit)'))
+        panel.add(maximum)
+        panel.add(JLabel('Skip MIME types'))
+        panel.add(mimeTypes)
+        panel.add(JLabel('Shard size in MB (0: scan in Burp)'))
+        panel.add(shardSize)
+        panel.add(JLabel('Python for shard workers'))
+        panel.add(python)
+        option = JOptionPane.showConfirmDialog(self.extender.master, panel, 'Filters - Burp Tracer', JOptionPane.OK_CANCEL_OPTION, JOptionPane.PLAIN_MESSAGE)
+        if option == JOptionPane.OK_OPTION:
+            self.extender.valueFilter = ValueFilter(minimum.value, numbers.selected, booleans.selected, cap.value)
+            self.extender.responseFilter = ResponseFilter(maximum.value << 10, mimeTypes.text.split(','))
+            self.extender.shardSize = shardSize.value
+            self.extender.python = python.text.strip() or 'python3'
+
+class SaveActionListener(ActionListener):
+
+    def __init__(self, extender):
+        super(SaveActionListener, self).__init__()
+        self.extender = extender
+
+    def actionPerformed(self, event):
+        chooser = JFileChooser()
+        chooser.selectedFile = File('trace.jsonl.gz')
+        if chooser.showSaveDialog(self.extender.master) == JFileChooser.APPROVE_OPTION:
+            self.extender.save(chooser.selectedFile.path)
+
+class ExportActionListener(ActionListener):
+
+    def __init__(self, extender):
+        super(ExportActionListener, self).__init__()
+        self.extender = extender
+
+    def actionPerformed(self, event):
+        jsonl = FileNameExtensionFilter('JSON Lines (*.jsonl)', ['jsonl'])
+        csv = FileNameExtensionFilter('CSV (*.csv)', ['csv'])
+        chooser = JFileChooser()
+        chooser.addChoosableFileFilter(jsonl)
+        chooser.addChoosableFileFilter(csv)
+        chooser.fileFilter = jsonl
+        chooser.selectedFile = File('trace.jsonl')
+        if chooser.showSaveDialog(self.extender.master) == JFileChooser.APPROVE_OPTION:
+            path = chooser.selectedFile.path
+            format = 'csv' if chooser.fileFilter is csv or path.lower().endswith('.csv') else 'jsonl'
+            self.extender.export(path, format)
+
+class LoadActionListener(ActionListener):
+
+    def __init__(self, extender):
+        super(LoadActionListener, self).__init__()
+        self.extender = extender
+
+    def actionPerformed(self, event):
+        chooser = JFileChooser()
+        if chooser.showOpenDialog(self.extender.master) == JFileChooser.APPROVE_OPTION:
+            self.extender.load(chooser.selectedFile.path)
+
+class ModeActionListener(ActionListener):
+
+    def __init__(self, extender, mode):
+        super(ModeActionListener, self).__init__()
+        self.extender = extender
+        self.mode = mode
+
+    def actionPerformed(self, event):
+        self.extender.setMode(self.mode)
+
 class InfoActionListener(ActionListener):
 
     def __init__(self, extender):
@@ -407,8 +908,18 @@ class ActionsPanel(JPanel):
         self.setLayout(GridLayout(2, 1))
         # Create children
         self.title = JLabel('Actions')
-        self.actions = JPanel(GridLayout(1, 3))
+        self.actions = JPanel(GridLayout(1, 11))
         self.start = JButton('Start')
+        self.stop = JButton('Stop')
+        self.live = JToggleButton('Live')
+        self.threads = JSpinner(SpinnerNumberModel(extender.threads, 1, 256, 1))
+        self.filters = JButton('Filters')
+        self.save = JButton('Save')
+        self.load = JButton('Load')
+        self.export = JButton('Export')
+        self.modes = ButtonGroup()
+        self.inputToOutput = JRadioButton('Input > Output', True)
+        self.outputToInput = JRadioButton('Output > Input')
         self.info = JButton('Info')
         # Configure children
         self.title.setFont(Fonts.Heading)
@@ -416,11 +927,41 @@ class ActionsPanel(JPanel):
         self.actions.layout.vgap = 0
         self.actions.layout.hgap = 0
         self.start.addActionListener(StartActionListener(extender))
+        self.stop.addActionListener(StopActionListener(extender))
+        self.stop.toolTipText = 'Stop the current run, keeping the results found so far'
+        self.stop.enabled = False
+        self.live.addActionListener(LiveActionListener(extender))
+        self.live.toolTipText = 'Trace new Proxy/HTTP traffic as it arrives'
+        self.threads.addChangeListener(ThreadsChangeListener(extender))
+        self.threads.toolTipText = 'Number of threads used to scan responses'
+        self.filters.addActionListener(FiltersActionListener(extender))
+        self.filters.toolTipText = 'Skip low-signal values and large or binary responses; applies from the next Start or Load'
+        self.save.addActionListener(SaveActionListener(extender))
+        self.save.toolTipText = 'Save the trace to a file'
+        self.load.addActionListener(LoadActionListener(extender))
+        self.load.toolTipText = 'Load a saved trace, re-scanning only new or changed items'
+        self.export.addActionListener(ExportActionListener(extender))
+        self.export.toolTipText = 'Export every hit as JSON Lines or CSV'
+        self.inputToOutput.addActionListener(ModeActionListener(extender, Mode.InputToOutput))
+        self.inputToOutput.toolTipText = 'Show where each input is reflected'
+        self.outputToInput.addActionListener(ModeActionListener(extender, Mode.OutputToInput))
+        self.outputToInput.toolTipText = 'Show which inputs flow into each response'
+        self.modes.add(self.inputToOutput)
+        self.modes.add(self.outputToInput)
         self.info.addActionListener(InfoActionListener(extender))
         # Add children
         self.add(self.title)
         self.add(self.actions)
         self.actions.add(self.start)
+        self.actions.add(self.stop)
+        self.actions.add(self.live)
+        self.actions.add(self.threads)
+        self.actions.add(self.filters)
+        self.actions.add(self.save)
+        self.actions.add(self.load)
+        self.actions.add(self.export)
+        self.actions.add(self.inputToOutput)
+        self.actions.add(self.outputToInput)
         self.actions.add(self.info)
 
     def refresh(self):
@@ -452,6 +993,53 @@ class HeadPanel(JPanel):
         self.title.registerExtenderCallbacks(callbacks)
         self.actions.registerExtenderCallbacks(callbacks)
 
+class FilterDocumentListener(DocumentListener):
+    """Restarts the filter timer on every edit, so that a burst of keystrokes filters once."""
+
+    def __init__(self, timer):
+        super(FilterDocumentListener, self).__init__()
+        self.timer = timer
+
+    def insertUpdate(self, event):
+        self.timer.restart()
+
+    def removeUpdate(self, event):
+        self.timer.restart()
+
+    def changedUpdate(self, event):
+        self.timer.restart()
+
+class FilterActionListener(ActionListener):
+
+    def __init__(self, extender):
+        super(FilterActionListener, self).__init__()
+        self.extender = extender
+
+    def actionPerformed(self, event):
+        self.extender.master.main.setFilter(self.extender.master.main.filter.field.text)
+
+class FilterPanel(JPanel):
+
+    DELAY = 150
+
+    def __init__(self, extender):
+        # Initialize self
+        super(FilterPanel, self).__init__()
+        self.extender = extender
+        self.setLayout(BorderLayout())
+        self.setBorder(EmptyBorder(2, 2, 2, 2))
+        # Create children
+        self.label = JLabel('Filter: ')
+        self.field = JTextField()
+        self.timer = Timer(FilterPanel.DELAY, FilterActionListener(extender))
+        # Configure children
+        self.field.toolTipText = 'Prefixes of parameter names, values or endpoints; narrow with name:, value:, in: or out:'
+        self.field.document.addDocumentListener(FilterDocumentListener(self.timer))
+        self.timer.repeats = False
+        # Add children
+        self.add(self.label, BorderLayout.WEST)
+        self.add(self.field, BorderLayout.CENTER)
+
 class MainPanel(JPanel):
 
     def __init__(self, extender):
@@ -461,35 +1049,143 @@ class MainPanel(JPanel):
         self.setLayout(BorderLayout())
         self.setBorder(BorderFactory.createLineBorder(Color.BLACK));
         # Create children
+        self.filter = FilterPanel(extender)
         self.tree = ResultTree(extender)
         # Add children
+        self.add(self.filter, BorderLayout.NORTH)
         self.add(JScrollPane(self.tree), BorderLayout.CENTER)
 
     def refresh(self):
         self.tree.refresh()
 
+    def trace(self, pairs):
+        self.tree.trace(pairs)
+
+    def save(self, path):
+        self.tree.save(path)
+
+    def export(self, path, format):
+        self.tree.export(path, format)
+
+    def setMode(self, mode):
+        self.tree.setMode(mode)
+
+    def setFilter(self, query):
+        self.tree.setFilter(query)
+
+    def stop(self):
+        self.tree.stop()
+
+    def load(self, path):
+        self.tree.load(path)
+
+    def close(self):
+        self.tree.close()
+
     def registerExtenderCallbacks(self, callbacks):
         self.tree.registerExtenderCallbacks(callbacks)
 
+class SwingRunnable(Runnable):
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def run(self):
+        self.function(*self.args)
+
+class ProgressThrottle:
+    """Applies progress bar updates on the EDT, at most once every INTERVAL seconds.
+
+    The first and last update of a run are always applied.
+    """
+
+    INTERVAL = 0.1
+
+    def __init__(self, bar):
+        self.bar = bar
+        self.last = 0.0
+        self.lock = threading.Lock()
+
+    def update(self, label, current, maximum, detail=None):
+        with self.lock:
+            now = time.time()
+            if 0 < current < maximum and now - self.last < ProgressThrottle.INTERVAL:
+                return
+            self.last = now
+        string = label if detail is None else '{} [{}/{}]: {}'.format(label, current, maximum, detail)
+        value = int(10000.0 * (float(current) / float(maximum))) if maximum else 0
+        SwingUtilities.invokeLater(SwingRunnable(self.apply, string, value))
+
+    def apply(self, string, value):
+        self.bar.string = string
+        self.bar.value = value
+
+class StatsActionListener(ActionListener):
+
+    def __init__(self, extender):
+        super(StatsActionListener, self).__init__()
+        self.extender = extender
+
+    def actionPerformed(self, event):
+        self.extender.master.foot.statsPane.visible = event.source.selected
+        self.extender.master.revalidate()
+
+class StatsExportActionListener(ActionListener):
+
+    def __init__(self, extender):
+        super(StatsExportActionListener, self).__init__()
+        self.extender = extender
+
+    def actionPerformed(self, event):
+        chooser = JFileChooser()
+        chooser.selectedFile = File('tracer-stats.json')
+        if chooser.showSaveDialog(self.extender.master) == JFileChooser.APPROVE_OPTION:
+            try:
+                with open(chooser.selectedFile.path, 'w') as f:
+                    json.dump(self.extender.stats.dict(), f, indent=2)
+            except Exception as e:
+                self.extender.processError('Unable to export stats', e)
+
 class FooterPanel(JPanel):
 
     def __init__(self, extender):
         # Initialize self
         super(FooterPanel, self).__init__()
         self.extender = extender
-        self.setLayout(GridLayout(2, 1))
+        self.setLayout(BorderLayout())
         # Create children
+        self.progress = JPanel(GridLayout(2, 1))
         self.progressInput = JProgressBar(0, 10000)
         self.progressOutput = JProgressBar(0, 10000)
+        self.statsActions = JPanel(FlowLayout(FlowLayout.LEFT))
+        self.statsToggle = JToggleButton('Stats')
+        self.statsExport = JButton('Export Stats')
+        self.stats = JTextArea(12, 80)
+        self.statsPane = JScrollPane(self.stats)
         self.credit = JPanel()
         # Configure children
         self.progressInput.string = 'Ready'
         self.progressOutput.string = 'Ready'
         self.progressInput.stringPainted = True
         self.progressOutput.stringPainted = True
+        self.throttleInput = ProgressThrottle(self.progressInput)
+        self.throttleOutput = ProgressThrottle(self.progressOutput)
+        self.statsToggle.addActionListener(StatsActionListener(extender))
+        self.statsToggle.toolTipText = 'Show timings and counters of the last run'
+        self.statsExport.addActionListener(StatsExportActionListener(extender))
+        self.statsExport.toolTipText = 'Save the stats of the last run as JSON'
+        self.stats.editable = False
+        self.stats.font = Font(Font.MONOSPACED, Font.PLAIN, 12)
+        self.statsPane.visible = False
         # Add children
-        self.add(self.progressInput)
-        self.add(self.progressOutput)
+        self.add(self.progress, BorderLayout.NORTH)
+        self.add(self.statsActions, BorderLayout.CENTER)
+        self.add(self.statsPane, BorderLayout.SOUTH)
+        self.progress.add(self.progressInput)
+        self.progress.add(self.progressOutput)
+        self.statsActions.add(self.statsToggle)
+        self.statsActions.add(self.statsExport)
 
     def refresh(self):
         pass
@@ -530,42 +1226,166 @@ class RefreshRunnable(Runnable):
 
     def run(self):
         self.extender.processStart()
-        self.extender.master.refresh()
+        try:
+            self.extender.master.refresh()
+        except Exception as e:
+            self.extender.processError('Unable to trace site map', e)
+        self.extender.processEnd()
+
+class SaveRunnable(Runnable):
+
+    def __init__(self, extender, path):
+        self.extender = extender
+        self.path = path
+
+    def run(self):
+        self.extender.processStart()
+        try:
+            self.extender.master.main.save(self.path)
+        except Exception as e:
+            self.extender.processError('Unable to save trace', e)
+        self.extender.processEnd()
+
+class ExportRunnable(Runnable):
+
+    def __init__(self, extender, path, format):
+        self.extender = extender
+        self.path = path
+        self.format = format
+
+    def run(self):
+        self.extender.processStart()
+        try:
+            self.extender.master.main.export(self.path, self.format)
+        except Exception as e:
+            self.extender.processError('Unable to export trace', e)
         self.extender.processEnd()
 
-class BurpExtender(IBurpExtender, ITab):
+class LoadRunnable(Runnable):
+
+    def __init__(self, extender, path):
+        self.extender = extender
+        self.path = path
+
+    def run(self):
+        self.extender.processStart()
+        try:
+            self.extender.master.main.load(self.path)
+        except Exception as e:
+            self.extender.processError('Unable to load trace', e)
+        self.extender.processEnd()
+
+class TraceRunnable(Runnable):
+    """Traces every live message queued so far in a single batch."""
+
+    def __init__(self, extender):
+        self.extender = extender
+
+    def run(self):
+        with self.extender.lock:
+            pairs = self.extender.pending
+            self.extender.pending = list()
+        try:
+            self.extender.master.main.trace(pairs)
+        except Exception as e:
+            self.extender.processError('Unable to trace live traffic', e)
+
+class BurpExtender(IBurpExtender, IExtensionStateListener, IHttpListener, ITab):
 
     def __init__(self):
         self.name = 'Tracer'
+        self.live = False
+        self.threads = Runtime.getRuntime().availableProcessors()
+        self.stats = TraceStats()
+        self.valueFilter = ValueFilter()
+        self.responseFilter = ResponseFilter()
+        self.shardSize = 0
+        self.python = 'python3'
+        self.executor = Executors.newSingleThreadExecutor()
+        self.pending = list()
+        self.lock = threading.Lock()
         self.master = None
         self.master = MasterPanel(self)
 
     def processStart(self):
-        self.master.head.actions.start.enabled = False
+        SwingUtilities.invokeLater(SwingRunnable(self.processEnable, False))
         self.progressCallbackInput('Ready', 0, 1)
         self.progressCallbackOutput('Ready', 0, 1)
 
     def processEnd(self):
-        self.master.head.actions.start.enabled = True
+        SwingUtilities.invokeLater(SwingRunnable(self.processEnable, True))
         self.progressCallbackInput('Done', 1, 1)
         self.progressCallbackOutput('Done', 1, 1)
 
-    def progressCallbackInput(self, string, current, maximum):
-        self.master.foot.progressInput.string = string
-        self.master.foot.progressInput.value = int(10000.0 * (float(current) / float(maximum)))
+    def processEnable(self, enabled):
+        self.master.head.actions.start.enabled = enabled
+        self.master.head.actions.stop.enabled = not enabled
+        self.master.head.actions.save.enabled = enabled
+        self.master.head.actions.load.enabled = enabled
+        self.master.head.actions.export.enabled = enabled
 
-    def progressCallbackOutput(self, string, current, maximum):
-        self.master.foot.progressOutput.string = string
-        self.master.foot.progressOutput.value = int(10000.0 * (float(current) / float(maximum)))
+    def processError(self, message, error):
+        # Called from worker threads, so the dialog is posted to the EDT
+        SwingUtilities.invokeLater(SwingRunnable(self.processErrorApply, '{}: {}'.format(message, error)))
+
+    def processErrorApply(self, text):
+        JOptionPane.showMessageDialog(self.master, text, 'Error - Burp Tracer', JOptionPane.ERROR_MESSAGE)
+
+    def progressCallbackInput(self, label, current, maximum, detail=None):
+        self.master.foot.throttleInput.update(label, current, maximum, detail)
+
+    def progressCallbackOutput(self, label, current, maximum, detail=None):
+        self.master.foot.throttleOutput.update(label, current, maximum, detail)
+
+    def statsCallback(self, stats):
+        self.stats = stats
+        SwingUtilities.invokeLater(SwingRunnable(self.statsApply, str(stats)))
+
+    def statsApply(self, text):
+        self.master.foot.stats.text = text
+        self.master.foot.stats.caretPosition = 0
 
     def refresh(self):
         thread = Thread(RefreshRunnable(self))
         thread.start()
 
+    def save(self, path):
+        thread = Thread(SaveRunnable(self, path))
+        thread.start()
+
+    def export(self, path, format):
+        thread = Thread(ExportRunnable(self, path, format))
+        thread.start()
+
+    def load(self, path):
+        thread = Thread(LoadRunnable(self, path))
+        thread.start()
+
+    def setMode(self, mode):
+        self.master.main.setMode(mode)
+
+    def stop(self):
+        self.master.main.stop()
+
     def registerExtenderCallbacks(self, callbacks):
         callbacks.setExtensionName('Tracer')
         callbacks.addSuiteTab(self)
         self.master.registerExtenderCallbacks(callbacks)
+        callbacks.registerHttpListener(self)
+        callbacks.registerExtensionStateListener(self)
+
+    def processHttpMessage(self, toolFlag, messageIsRequest, messageInfo):
+        if self.live and not messageIsRequest:
+            # Messages that arrive while a batch is being traced wait for the next one
+            with self.lock:
+                self.pending.append(messageInfo)
+                if len(self.pending) == 1:
+                    self.executor.submit(TraceRunnable(self))
+
+    def extensionUnloaded(self):
+        self.executor.shutdownNow()
+        self.master.main.stop()
+        self.master.main.close()
 
     def getTabCaption(self):
         return self.name
@@ -0,0 +1,1518 @@
+"""Headless engine behind the Tracer Burp extension.
+
+Runs under both CPython and Jython. When run as a script, it traces a Burp
+"Save items" XML export or a HAR file and writes one JSON object or CSV row
+per hit:
+
+    python tracer_engine.py [--scope REGEX] [--output FILE] [--format FORMAT]
+                            [--min-length N] [--keep-numbers] [--keep-booleans] [--cap N]
+                            [--max-body-size BYTES] [--skip-mime-types LIST] EXPORT
+
+It is also the worker that ShardPool runs on each shard of a site map:
+
+    python tracer_engine.py shard VARIANTS SHARD HITS
+"""
+
+import argparse
+import base64
+import bisect
+import collections
+import csv
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+try:
+    from urllib import quote, quote_plus, unquote_plus
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import quote, quote_plus, unquote_plus, urlparse
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used entry beyond capacity."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+Parameter = collections.namedtuple('Parameter', ['name', 'value'])
+
+Service = collections.namedtuple('Service', ['protocol', 'host', 'port'])
+
+def encode(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+def decode(data):
+    return data if isinstance(data, str) else data.decode('latin-1')
+
+def origin(service):
+    return '{}://{}:{}'.format(service.protocol, service.host, service.port)
+
+def digest(service, request, response):
+    """Returns a content hash identifying a request/response pair across sessions."""
+    sha = hashlib.sha1()
+    sha.update(encode(origin(service)))
+    sha.update(encode(request))
+    if response is not None:
+        sha.update(encode(response))
+    return sha.hexdigest()
+
+def excerpt(text, offset, length, left=20, right=20, base=0):
+    """Returns the match at offset with some surrounding context.
+
+    Offsets count from base, so that a body can be excerpted in place from the
+    message that contains it.
+    """
+    start = max(base, base + offset - left)
+    end = min(len(text), base + offset + length + right)
+    return '{}{}{}'.format('...' if start > base else '', text[start:end], '...' if end < len(text) else '')
+
+def contents(message):
+    """Returns the text of a message, reading it back from its shard if it was spilled."""
+    return message.text() if isinstance(message, ShardMessage) else message
+
+class TraceStats:
+    """Per-phase timers and counters of a trace run.
+
+    Not thread-safe: scan workers keep their own figures, which the index
+    merges once the workers are done.
+    """
+
+    SLOWEST = 10
+
+    def __init__(self):
+        self.timers = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.slowest = list()
+
+    def time(self, phase, seconds):
+        self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+
+    def count(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def responses(self, timings):
+        """Records (seconds, url) scan timings, keeping only the slowest."""
+        self.slowest = heapq.nlargest(TraceStats.SLOWEST, self.slowest + list(timings))
+
+    def dict(self):
+        stats = collections.OrderedDict()
+        stats['timers'] = collections.OrderedDict((phase, round(seconds, 6)) for phase, seconds in self.timers.items())
+        stats['counters'] = collections.OrderedDict(self.counters)
+        stats['slowest'] = [collections.OrderedDict([('url', url), ('seconds', round(seconds, 6))]) for seconds, url in self.slowest]
+        return stats
+
+    def __str__(self):
+        lines = ['Phases (seconds):']
+        lines.extend('  {:<12} {:>10.3f}'.format(phase, seconds) for phase, seconds in self.timers.items())
+        lines.append('Counters:')
+        lines.extend('  {:<12} {:>10}'.format(counter, amount) for counter, amount in self.counters.items())
+        lines.append('Slowest responses (seconds):')
+        lines.extend('  {:>10.3f} {}'.format(seconds, url) for seconds, url in self.slowest)
+        return '\n'.join(lines)
+
+class SiteMapItem:
+    """Compact, pre-analyzed record of a single site map entry.
+
+    The response is kept whole in message and its body starts at offset; hit
+    offsets count from there, so the body is never sliced out of it. message
+    is None for responses that are not scanned.
+    """
+
+    def __init__(self, index, service, url, method, parameters, scope, offset, message, digest):
+        self.index = index
+        self.service = service
+        self.url = url
+        self.method = method
+        self.parameters = parameters
+        self.scope = scope
+        self.offset = offset
+        self.message = message
+        self.digest = digest
+
+class ResponseFilter:
+    """Keeps large and binary responses out of the scan.
+
+    Bodies longer than maximum bytes (0 for no limit) and responses whose MIME
+    type, or either half of it, is in mimeTypes are neither converted to text
+    nor scanned.
+    """
+
+    MIME_TYPES = ('image', 'png', 'jpeg', 'gif', 'bmp', 'tiff', 'ico', 'video', 'audio', 'font', 'app', 'octet-stream')
+
+    def __init__(self, maximum=4 << 20, mimeTypes=MIME_TYPES):
+        self.maximum = maximum
+        self.mimeTypes = frozenset(mimeType.strip().lower() for mimeType in mimeTypes if mimeType.strip())
+
+    def accepts(self, length, mimeType):
+        if self.maximum and length > self.maximum:
+            return False
+        kinds = (mimeType or '').split(';')[0].strip().lower()
+        return not any(kind in self.mimeTypes for kind in [kinds] + kinds.split('/'))
+
+class SiteMapSnapshot:
+    """Analyzes every Burp site map entry exactly once per trace.
+
+    Items whose bodies are byte-identical share one copy of the response,
+    which the scan then matches only once.
+
+    If shards (a ShardPool) is given, the first copy of each body is spilled
+    to it and items hold a ShardMessage instead of the response text.
+
+    The callbacks only need to provide getSiteMap, isInScope and helpers; url
+    converts URL strings into what isInScope expects (java.net.URL in Burp).
+    """
+
+    def __init__(self, callbacks, url=str, stats=None, filter=None, shards=None):
+        self.callbacks = callbacks
+        self.url = url
+        self.stats = stats if stats is not None else TraceStats()
+        self.filter = filter if filter is not None else ResponseFilter()
+        self.items = list()
+        self.scopes = dict()
+        self.strings = dict()
+        self.bodies = dict()
+        self.shards = shards
+
+    def isInScope(self, url):
+        if url not in self.scopes:
+            self.scopes[url] = self.callbacks.isInScope(self.url(url))
+        return self.scopes[url]
+
+    def analyze(self, pair):
+        helpers = self.callbacks.helpers
+        start = time.time()
+        rq = helpers.analyzeRequest(pair.httpService, pair.request)
+        url = self.intern(str(rq.url))
+        parameters = [Parameter(self.intern(p.name), self.intern(p.value)) for p in rq.parameters]
+        scope = self.isInScope(url)
+        offset = None
+        message = None
+        rp = helpers.analyzeResponse(pair.response) if scope and pair.response else None
+        analyzed = time.time()
+        if rp is not None:
+            offset = rp.bodyOffset
+            # Convert the bytes once, and only for responses worth scanning
+            if self.filter.accepts(len(pair.response) - offset, rp.inferredMimeType or rp.statedMimeType):
+                message = pair.response.tostring()
+            else:
+                self.stats.count('skipped')
+        copied = time.time()
+        # Keep a plain Service rather than Burp's IHttpService, which nodes would otherwise hold on to
+        service = self.intern(Service(str(pair.httpService.protocol), str(pair.httpService.host), int(pair.httpService.port)))
+        item = SiteMapItem(len(self.items), service, url, self.intern(rq.method), parameters, scope, offset, message, digest(service, pair.request.tostring(), message))
+        if message is not None:
+            self.share(item)
+        self.stats.time('analyze', analyzed - start)
+        self.stats.time('copy', copied - analyzed)
+        self.stats.time('digest', time.time() - copied)
+        self.stats.count('items')
+        return item
+
+    def add(self, pair):
+        item = self.analyze(pair)
+        self.items.append(item)
+        return item
+
+    def share(self, item):
+        # Point items whose bodies are byte-identical at a single copy of the body
+        key = hashlib.sha1(encode(item.message[item.offset:])).digest()
+        shared = self.bodies.get(key)
+        if shared is None:
+            if self.shards is not None:
+                item.message = self.shards.add(item)
+                item.offset = 0
+            self.bodies[key] = item
+        else:
+            item.message = shared.message
+            item.offset = shared.offset
+            self.stats.count('shared')
+
+    def intern(self, text):
+        # Share one copy of each service, URL, method and parameter across items and nodes
+        return self.strings.setdefault(text, text)
+
+    def restore(self, item):
+        """Appends a previously saved item that is no longer in the site map."""
+        item.service = self.intern(Service(*item.service))
+        item.url = self.intern(item.url)
+        item.method = self.intern(item.method)
+        item.parameters = [Parameter(self.intern(param.name), self.intern(param.value)) for param in item.parameters]
+        item.index = len(self.items)
+        self.items.append(item)
+        return item
+
+    def capture(self, progress, stopping=None):
+        sitemap = self.callbacks.getSiteMap(None)
+        current = 0
+        progress('Ready', current, len(sitemap))
+        for pair in sitemap:
+            if stopping is not None and stopping.is_set():
+                break
+            item = self.add(pair)
+            current += 1
+            progress('Inspecting Inputs', current, len(sitemap), item.url)
+        return self.items
+
+class Matcher:
+    """Finds every occurrence of a set of values in a single pass over a text.
+
+    Uses the pyahocorasick extension when it is available and falls back to a
+    pure-Python Aho-Corasick automaton otherwise (e.g. under Jython).
+    """
+
+    def __init__(self, values):
+        self.values = set(value for value in values if value)
+        if ahocorasick is not None:
+            self.automaton = ahocorasick.Automaton()
+            for value in self.values:
+                self.automaton.add_word(value, value)
+            if self.values:
+                self.automaton.make_automaton()
+        else:
+            self.automaton = None
+            self.build()
+
+    def build(self):
+        # Build trie
+        self.goto = [dict()]
+        self.fail = [0]
+        self.output = [list()]
+        for value in self.values:
+            state = 0
+            for char in value:
+                if char not in self.goto[state]:
+                    self.goto.append(dict())
+                    self.fail.append(0)
+                    self.output.append(list())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(value)
+        # Build failure links breadth-first
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def finditer(self, text, start=0):
+        """Yields (value, offset) for every occurrence of every value in text[start:], without slicing it.
+
+        Offsets count from start.
+        """
+        if not self.values:
+            return
+        if self.automaton is not None:
+            for end, value in self.automaton.iter(text, start):
+                yield value, end - len(value) + 1 - start
+            return
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        state = 0
+        for index, char in enumerate(itertools.islice(text, start, None)):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for value in output[state]:
+                yield value, index - len(value) + 1
+
+class Encodings:
+    """Encoded forms in which an input value may be reflected back."""
+
+    Raw = 'raw'
+    Lowercase = 'lowercase'
+    Uppercase = 'uppercase'
+    UrlDecoded = 'url-decoded'
+    UrlEncoded = 'url-encoded'
+    Html = 'html'
+    Json = 'json'
+
+    @staticmethod
+    def variants(value):
+        """Returns the distinct (variant, encoding) pairs of value, raw form first."""
+        decoded = unquote_plus(value)
+        candidates = [
+            (value, Encodings.Raw),
+            (decoded, Encodings.UrlDecoded),
+            (quote(encode(value), ''), Encodings.UrlEncoded),
+            (quote_plus(encode(value), ''), Encodings.UrlEncoded),
+        ]
+        # Values often arrive URL-encoded and are reflected decoded and then
+        # re-encoded, so the other forms are built from both
+        for base in (value, decoded):
+            escaped = base.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+            quoted = json.dumps(base)[1:-1]
+            # Many serializers also escape HTML-significant characters, e.g. < as \u003c
+            hexed = quoted.replace('&', '\\u0026').replace("'", '\\u0027')
+            candidates.extend([
+                (escaped.replace("'", '&#39;'), Encodings.Html),
+                (escaped.replace("'", '&#x27;'), Encodings.Html),
+                (quoted, Encodings.Json),
+                (quoted.replace('/', '\\/'), Encodings.Json),
+                (hexed.replace('<', '\\u003c').replace('>', '\\u003e'), Encodings.Json),
+                (hexed.replace('<', '\\u003C').replace('>', '\\u003E'), Encodings.Json),
+            ])
+        for base in (value, decoded):
+            candidates.extend([
+                (base.lower(), Encodings.Lowercase),
+                (base.upper(), Encodings.Uppercase),
+            ])
+        variants = list()
+        seen = set()
+        for variant, encoding in candidates:
+            if variant and variant not in seen:
+                seen.add(variant)
+                variants.append((variant, encoding))
+        return variants
+
+class Contexts:
+    """Syntactic contexts in which a hit may land inside a response body.
+
+    tokenize splits a body into runs of a single context and returns the
+    body offsets where each run starts along with its context, so that the
+    context of any hit is found by bisection. Bodies that start with { or [
+    are JSON throughout; anything else is read as HTML, with a lenient scan
+    that never fails on malformed markup.
+    """
+
+    Text = 'text'
+    Tag = 'tag'
+    Attribute = 'attribute'
+    Script = 'script'
+    Style = 'style'
+    Comment = 'comment'
+    Json = 'json'
+
+    OPEN = re.compile(r'<(?:!--|/?([A-Za-z][^\s/>]*))')
+    INSIDE = re.compile(r"""=\s*(?:"([^"]*)"?|'([^']*)'?|([^\s"'>]+))|>""")
+    CLOSE = {
+        'script': re.compile(r'</script', re.I),
+        'style': re.compile(r'</style', re.I),
+    }
+    JSON = re.compile(r'\s*[\[{]')
+
+    @staticmethod
+    def tokenize(text, base=0):
+        if Contexts.JSON.match(text, base):
+            return [0], [Contexts.Json]
+        bounds = [0]
+        labels = [Contexts.Text]
+        def mark(context, position):
+            position -= base
+            if bounds[-1] == position:
+                labels[-1] = context
+                if len(labels) > 1 and labels[-2] == context:
+                    bounds.pop()
+                    labels.pop()
+            elif labels[-1] != context:
+                bounds.append(position)
+                labels.append(context)
+        position = base
+        while True:
+            tag = Contexts.OPEN.search(text, position)
+            if tag is None:
+                break
+            if tag.group(1) is None:
+                mark(Contexts.Comment, tag.start())
+                end = text.find('-->', tag.end())
+                position = len(text) if end < 0 else end + 3
+                mark(Contexts.Text, position)
+                continue
+            # Attribute values are the only part of a tag that is not markup
+            mark(Contexts.Tag, tag.start())
+            position = tag.end()
+            while True:
+                inside = Contexts.INSIDE.search(text, position)
+                if inside is None:
+                    position = len(text)
+                    break
+                position = inside.end()
+                if inside.group(0) == '>':
+                    break
+                group = next(group for group in (1, 2, 3) if inside.group(group) is not None)
+                mark(Contexts.Attribute, inside.start(group))
+                mark(Contexts.Tag, inside.end(group))
+            name = tag.group(1).lower()
+            if name in Contexts.CLOSE and not tag.group(0).startswith('</'):
+                mark(name, position)
+                close = Contexts.CLOSE[name].search(text, position)
+                position = len(text) if close is None else close.start()
+            mark(Contexts.Text, position)
+        return bounds, labels
+
+class ContextClassifier:
+    """Labels hits with the context they land in, tokenizing each body at most once while cached.
+
+    Bodies are tokenized on the first label asked of them and their runs are
+    kept in an LRU cache of capacity bodies; bodies shared by several items
+    are tokenized once for all of them. classify labels a whole list of hits
+    in one pass, without going through the cache.
+    """
+
+    def __init__(self, capacity=256):
+        self.cache = LRUCache(capacity)
+
+    @staticmethod
+    def key(sitem):
+        return (id(sitem.message), sitem.offset)
+
+    @staticmethod
+    def find(runs, offset):
+        bounds, labels = runs
+        return labels[bisect.bisect_right(bounds, offset) - 1]
+
+    def runs(self, sitem):
+        # Entries keep their message alive, so that its id cannot be reused while cached
+        entry = self.cache.get(ContextClassifier.key(sitem))
+        if entry is None or entry[0] is not sitem.message:
+            entry = (sitem.message, Contexts.tokenize(contents(sitem.message), sitem.offset))
+            self.cache.put(ContextClassifier.key(sitem), entry)
+        return entry[1]
+
+    def label(self, sitem, offset):
+        """Returns the context of the hit at offset in the body of sitem, or None if the body is gone."""
+        if sitem.message is None:
+            return None
+        return ContextClassifier.find(self.runs(sitem), offset)
+
+    def clear(self):
+        self.cache.clear()
+
+    @staticmethod
+    def classify(hits):
+        """Returns the context of every (item, param, sitem, offset, length, encoding) hit, in order."""
+        labels = [None] * len(hits)
+        order = sorted((ContextClassifier.key(hit[2]), number) for number, hit in enumerate(hits) if hit[2].message is not None)
+        key = None
+        runs = None
+        for body, number in order:
+            sitem = hits[number][2]
+            if body != key:
+                key = body
+                runs = Contexts.tokenize(contents(sitem.message), sitem.offset)
+            labels[number] = ContextClassifier.find(runs, hits[number][3])
+        return labels
+
+class ValueFilter:
+    """Keeps low-signal input values away from the matcher.
+
+    Values shorter than minimum, plain numbers (if numbers is set) and
+    boolean-like words (if booleans is set) are never searched for, and at
+    most cap hits are kept per value, across all of its encodings (0 keeps
+    them all).
+    """
+
+    NUMBER = re.compile(r'^[-+]?[0-9]+(\.[0-9]+)?$')
+    BOOLEANS = frozenset(['true', 'false', 'yes', 'no', 'on', 'off', 'null', 'none', 'undefined'])
+
+    def __init__(self, minimum=3, numbers=True, booleans=True, cap=100):
+        self.minimum = minimum
+        self.numbers = numbers
+        self.booleans = booleans
+        self.cap = cap
+
+    def accepts(self, value):
+        if len(value) < self.minimum:
+            return False
+        if self.numbers and ValueFilter.NUMBER.match(value):
+            return False
+        if self.booleans and value.lower() in ValueFilter.BOOLEANS:
+            return False
+        return True
+
+class TraceIndex:
+    """Input values and scanned outputs of a trace, extendable incrementally.
+
+    Every value is expanded into its encoded variants, and outputs are matched
+    against all variants in one pass. Variants are kept in generations of
+    matchers so that adding a value does not rebuild the automaton over every
+    known variant; generations are merged once there are more than
+    GENERATIONS of them. Outputs are scanned in batches of BATCH, so that
+    callers can publish hits while a long scan is still running.
+    """
+
+    GENERATIONS = 8
+    BATCH = 256
+
+    def __init__(self, stats=None, filter=None):
+        self.stats = stats if stats is not None else TraceStats()
+        self.filter = filter if filter is not None else ValueFilter()
+        self.inputs = dict()
+        self.variants = dict()
+        self.outputs = list()
+        self.hits = dict()
+        self.counts = dict()
+        self.skipped = set()
+        self.matchers = list()
+        self.pending = list()
+        self.queued = list()
+
+    def add(self, items, progress=None, threads=1, stopping=None, publish=None):
+        """Indexes items and returns (item, param, sitem, offset, length, encoding) for every new hit.
+
+        If stopping is set while scanning, the hits found so far are returned
+        and the work left is resumed on the next call: first the search of
+        existing outputs for new variants, where it left off, then the outputs
+        that were not scanned yet, ahead of those of the new items. If publish
+        is given, it is also called with the new hits of every batch of
+        outputs as soon as that batch has been scanned.
+        """
+        self.generations()
+        hits = list()
+        fresh = self.register(items, hits)
+        if publish and hits:
+            publish(list(hits))
+        outputs = self.queued + [item for item in items if item.scope and item.message is not None]
+        self.queued = list()
+        # Search existing outputs for new variants only
+        if fresh:
+            self.pending.append((self.build(fresh), 0))
+        while self.pending:
+            matcher, position = self.pending[0]
+            position += self.scan([matcher], self.outputs[position:], hits, progress, threads, stopping, publish)
+            if position < len(self.outputs):
+                self.pending[0] = (matcher, position)
+                self.queued = outputs
+                return hits
+            # Only a matcher that has searched every existing output becomes a generation
+            self.pending.pop(0)
+            self.matchers.append(matcher)
+            if len(self.matchers) > TraceIndex.GENERATIONS:
+                waiting = set(variant for matcher, position in self.pending for variant in matcher.values)
+                self.matchers = [self.build(variant for variant in self.variants if variant not in waiting)]
+        # Search new outputs for every variant
+        scanned = self.scan(self.matchers, outputs, hits, progress, threads, stopping, publish)
+        self.outputs.extend(outputs[:scanned])
+        self.queued = outputs[scanned:]
+        return hits
+
+    def restore(self, items, found):
+        """Indexes items whose (variant, sitem, offset) hits are already known, without scanning."""
+        hits = list()
+        self.register(items, hits)
+        self.outputs.extend(item for item in items if item.scope and item.message is not None)
+        self.matchers = [self.build(self.variants.keys())]
+        self.merge([hit for hit in found if hit[0] in self.variants], hits)
+        return hits
+
+    def spill(self, items, pool, progress=None, stopping=None, publish=None):
+        """Indexes items like add, but matches their outputs in worker processes.
+
+        The outputs of items must have been written to the shards of pool while
+        capturing; the hits of every shard are merged as soon as it is done.
+        Outputs sharing a body (see SiteMapSnapshot.share) are spilled once and
+        get the hits of that body.
+        """
+        hits = list()
+        self.register(items, hits)
+        # The workers do the matching, so the in-process matcher waits for the first add or match
+        self.matchers = None
+        spilled = dict()
+        members = dict()
+        for item in items:
+            if item.scope and item.message is not None:
+                spilled[item.index] = item.message
+                members.setdefault(id(item.message), list()).append(item)
+        for shard, found in pool.run(self.variants.keys(), progress, stopping):
+            start = time.time()
+            self.stats.count('shards')
+            self.stats.count('matches', len(found))
+            batch = list()
+            self.merge([(variant, sitem, offset) for variant, index, offset in found if variant in self.variants for sitem in members[id(spilled[index])]], batch)
+            self.stats.count('hits', len(batch))
+            self.stats.time('merge', time.time() - start)
+            hits.extend(batch)
+            if publish and batch:
+                publish(batch)
+        # Only outputs of finished shards count as scanned; the rest are scanned in process by the next add
+        for item in items:
+            if item.scope and item.message is not None:
+                (self.outputs if item.message.path in pool.done else self.queued).append(item)
+        return hits
+
+    def prepare(self, items):
+        """Indexes the inputs of items so that outputs can be matched one at a time."""
+        self.register(items, list())
+        self.matchers = [self.build(self.variants.keys())]
+
+    def scanned(self):
+        """Returns the outputs that have been searched for every registered variant."""
+        end = min([position for matcher, position in self.pending] + [len(self.outputs)])
+        return self.outputs[:end]
+
+    def generations(self):
+        # Builds the matcher deferred by spill, before any new variant is registered
+        if self.matchers is None:
+            self.matchers = [self.build(self.variants.keys())]
+        return self.matchers
+
+    def build(self, variants):
+        start = time.time()
+        matcher = Matcher(variants)
+        self.stats.time('build', time.time() - start)
+        return matcher
+
+    def match(self, sitem):
+        """Returns the hits of a single output against every known variant, without indexing it."""
+        found = list()
+        for matcher in self.generations():
+            for variant, offset in matcher.finditer(contents(sitem.message), sitem.offset):
+                found.append((variant, sitem, offset))
+        found.sort(key=lambda hit: hit[2])
+        hits = list()
+        for variant, sitem, offset in found:
+            for value, encoding in self.variants[variant]:
+                if self.admit(value):
+                    for item, param in self.inputs[value]:
+                        hits.append((item, param, sitem, offset, len(variant), encoding))
+        return hits
+
+    def register(self, items, hits):
+        # Register inputs and their variants
+        start = time.time()
+        fresh = set()
+        known = list()
+        values = collections.OrderedDict()
+        for item in items:
+            if item.scope:
+                for param in item.parameters:
+                    if not param.value:
+                        continue
+                    if not self.filter.accepts(param.value):
+                        self.stats.count('filtered')
+                        continue
+                    if param.value not in self.inputs:
+                        self.inputs[param.value] = list()
+                        values[param.value] = True
+                        for variant, encoding in Encodings.variants(param.value):
+                            if variant not in self.variants:
+                                self.variants[variant] = list()
+                                fresh.add(variant)
+                            self.variants[variant].append((param.value, encoding))
+                    elif param.value not in values:
+                        known.append((item, param))
+                    self.inputs[param.value].append((item, param))
+        # Replay known hits for new inputs of known values, except those capped for the value
+        for item, param in known:
+            for variant, encoding in Encodings.variants(param.value):
+                for sitem, offset in self.hits.get(variant, ()):
+                    if (param.value, variant, sitem.index, offset) not in self.skipped:
+                        hits.append((item, param, sitem, offset, len(variant), encoding))
+        # Replay known hits for new values sharing a known variant, counting them against the new value
+        for value in values:
+            for variant, encoding in Encodings.variants(value):
+                if variant not in fresh:
+                    for sitem, offset in self.hits.get(variant, ()):
+                        if not self.admit(value):
+                            self.skipped.add((value, variant, sitem.index, offset))
+                            continue
+                        for item, param in self.inputs[value]:
+                            hits.append((item, param, sitem, offset, len(variant), encoding))
+        self.stats.count('values', len(values))
+        self.stats.count('variants', len(fresh))
+        self.stats.time('register', time.time() - start)
+        return fresh
+
+    def scan(self, matchers, outputs, hits, progress, threads, stopping, publish=None):
+        # Match outputs across workers, one batch at a time
+        queue = ScanQueue(outputs, progress, stopping)
+        while queue.current < len(outputs):
+            start = time.time()
+            first = queue.current
+            queue.limit = min(len(outputs), queue.current + TraceIndex.BATCH)
+            workers = [ScanWorker(matchers, queue) for i in range(max(1, min(threads, queue.limit - queue.current)))]
+            if len(workers) == 1:
+                workers[0].run()
+            else:
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+            for worker in workers:
+                if worker.error is not None:
+                    raise worker.error
+            # Merge thread-local hits and figures
+            found = list()
+            for worker in workers:
+                found.extend(worker.found)
+                self.stats.count('bytes', worker.bytes)
+                self.stats.count('deduplicated', worker.skipped)
+                self.stats.responses(worker.timings)
+            queue.replay(first, queue.current, found)
+            self.stats.count('matches', len(found))
+            merging = time.time()
+            self.stats.time('search', merging - start)
+            batch = list()
+            self.merge(found, batch)
+            self.stats.count('hits', len(batch))
+            self.stats.time('merge', time.time() - merging)
+            hits.extend(batch)
+            if publish and batch:
+                publish(batch)
+            if queue.current < queue.limit:
+                break
+        return queue.current
+
+    def merge(self, found, hits):
+        # Fan out (variant, sitem, offset) hits in site map order
+        found.sort(key=lambda hit: (hit[1].index, hit[2]))
+        for variant, sitem, offset in found:
+            admitted = [(value, encoding) for value, encoding in self.variants[variant] if self.admit(value)]
+            if not admitted:
+                continue
+            self.hits.setdefault(variant, list()).append((sitem, offset))
+            # Values sharing the variant are capped separately; remember which ones this hit skipped
+            if len(admitted) < len(self.variants[variant]):
+                self.skipped.update((value, variant, sitem.index, offset) for value, encoding in self.variants[variant] if (value, encoding) not in admitted)
+            for value, encoding in admitted:
+                for item, param in self.inputs[value]:
+                    hits.append((item, param, sitem, offset, len(variant), encoding))
+
+    def admit(self, value):
+        # Count a hit of value, in any of its encodings, against the cap
+        count = self.counts.get(value, 0)
+        if self.filter.cap and count >= self.filter.cap:
+            self.stats.count('capped')
+            return False
+        self.counts[value] = count + 1
+        return True
+
+class ScanQueue:
+    """Hands out outputs to scan workers one at a time and reports progress.
+
+    Outputs that share a body in memory (see SiteMapSnapshot.share) are only
+    scanned through the first of them, whose matches are kept in shared so
+    that they can be replayed for the others.
+    """
+
+    def __init__(self, outputs, progress, stopping):
+        self.outputs = outputs
+        self.progress = progress
+        self.stopping = stopping
+        self.current = 0
+        self.limit = len(outputs)
+        self.lock = threading.Lock()
+        # Find the first output of every body that more than one output shares
+        first = dict()
+        self.canonical = dict()
+        for sitem in outputs:
+            key = ScanQueue.body(sitem)
+            if key in first:
+                self.canonical[key] = first[key]
+            else:
+                first[key] = sitem
+        self.shared = dict((key, list()) for key in self.canonical)
+
+    @staticmethod
+    def body(sitem):
+        return (id(sitem.message), sitem.offset)
+
+    def alias(self, sitem):
+        """Returns the output whose scan sitem reuses, or None if sitem must be scanned itself."""
+        canonical = self.canonical.get(ScanQueue.body(sitem))
+        return canonical if canonical is not None and canonical is not sitem else None
+
+    def replay(self, start, end, found):
+        # Fan the matches of shared bodies out to the outputs that skipped them
+        for sitem in itertools.islice(self.outputs, start, end):
+            if self.alias(sitem) is not None:
+                found.extend((variant, sitem, offset) for variant, offset in self.shared[ScanQueue.body(sitem)])
+
+    def next(self):
+        with self.lock:
+            if self.current >= self.limit:
+                return None
+            if self.stopping is not None and self.stopping.is_set():
+                return None
+            self.current += 1
+            return self.outputs[self.current - 1]
+
+    def done(self, sitem):
+        if self.progress:
+            with self.lock:
+                self.progress(sitem, self.current, len(self.outputs))
+
+class ScanWorker(threading.Thread):
+    """Matches outputs from a ScanQueue into a thread-local hit list."""
+
+    def __init__(self, matchers, queue):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.matchers = matchers
+        self.queue = queue
+        self.found = list()
+        self.bytes = 0
+        self.skipped = 0
+        self.timings = list()
+        self.error = None
+
+    def run(self):
+        try:
+            sitem = self.queue.next()
+            while sitem is not None:
+                if self.queue.alias(sitem) is not None:
+                    self.skipped += 1
+                    self.queue.done(sitem)
+                    sitem = self.queue.next()
+                    continue
+                start = time.time()
+                shared = self.queue.shared.get(ScanQueue.body(sitem))
+                text = contents(sitem.message)
+                for matcher in self.matchers:
+                    for variant, offset in matcher.finditer(text, sitem.offset):
+                        self.found.append((variant, sitem, offset))
+                        if shared is not None:
+                            shared.append((variant, offset))
+                self.timings.append((time.time() - start, sitem.url))
+                self.bytes += len(sitem.message) - sitem.offset
+                self.queue.done(sitem)
+                sitem = self.queue.next()
+        except Exception as e:
+            self.error = e
+
+class ShardMessage(object):
+    """A response body spilled to a shard file, read back only when it is sliced or scanned.
+
+    Bodies are stored as raw latin-1 bytes starting at position, so a slice
+    reads only its own span of the file.
+    """
+
+    __slots__ = ('path', 'position', 'length')
+
+    def __init__(self, path, position, length):
+        self.path = path
+        self.position = position
+        self.length = length
+
+    def read(self, start, end):
+        with open(self.path, 'rb') as f:
+            f.seek(self.position + start)
+            return decode(f.read(max(0, end - start)))
+
+    def text(self):
+        return self.read(0, self.length)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, step = index.indices(self.length)
+            return self.read(start, end) if step == 1 else self.text()[index]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('shard message index out of range')
+        return self.read(index, index + 1)
+
+    def __iter__(self):
+        return iter(self.text())
+
+class ShardPool:
+    """Spills response bodies to shard files and matches them in worker processes.
+
+    Bodies are written to shards of at most size bytes in a temporary
+    directory, each as an "index length" line followed by the raw body. run
+    then starts up to processes workers at a time, each running this module
+    under command (a CPython interpreter) against one shard and the full set
+    of variants, and yields the (variant, item index, offset) hits of every
+    shard as it finishes. Peak memory per worker is bounded by the variants
+    and its largest body.
+    """
+
+    POLL = 0.05
+
+    def __init__(self, size, command='python3', processes=1):
+        self.size = size
+        self.command = command
+        self.processes = max(1, processes)
+        self.directory = tempfile.mkdtemp(prefix='tracer-')
+        self.shards = list()
+        self.done = set()
+        self.f = None
+        self.written = 0
+
+    def add(self, item):
+        """Writes the body of item to the current shard and returns a ShardMessage for it."""
+        if self.f is None or self.written >= self.size:
+            self.close()
+            self.shards.append(os.path.join(self.directory, 'shard-{:05d}.shard'.format(len(self.shards))))
+            self.f = open(self.shards[-1], 'wb')
+            self.written = 0
+        body = item.message[item.offset:]
+        data = body if isinstance(body, bytes) else body.encode('latin-1')
+        self.f.write(encode('{} {}\n'.format(item.index, len(data))))
+        position = self.f.tell()
+        self.f.write(data)
+        # Flush, so that live traffic spilled after a run can be read back at once
+        self.f.flush()
+        self.written += len(body)
+        return ShardMessage(self.shards[-1], position, len(body))
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def run(self, variants, progress=None, stopping=None):
+        self.close()
+        path = os.path.join(self.directory, 'variants.json')
+        with open(path, 'wb') as f:
+            f.write(encode(json.dumps(list(variants))))
+        script = os.path.abspath(__file__)
+        if script.endswith('$py.class'):
+            script = script[:-len('$py.class')] + '.py'
+        elif script.endswith('.pyc'):
+            script = script[:-1]
+        pending = collections.deque(self.shards)
+        running = list()
+        try:
+            while pending or running:
+                if stopping is not None and stopping.is_set():
+                    return
+                while pending and len(running) < self.processes:
+                    shard = pending.popleft()
+                    output = shard[:-len('.shard')] + '.hits'
+                    process = subprocess.Popen([self.command, script, 'shard', path, shard, output], stderr=subprocess.PIPE)
+                    running.append((process, shard, output))
+                for process, shard, output in list(running):
+                    if process.poll() is None:
+                        continue
+                    running.remove((process, shard, output))
+                    if process.returncode != 0:
+                        raise RuntimeError('Shard worker failed on {}: {}'.format(shard, process.stderr.read().decode('utf-8', 'replace').strip()))
+                    process.stderr.close()
+                    found = list()
+                    with open(output, 'rb') as f:
+                        for line in f:
+                            found.append(tuple(json.loads(line.decode('utf-8'))))
+                    self.done.add(shard)
+                    if progress:
+                        progress(shard, len(self.done), len(self.shards))
+                    yield shard, found
+                time.sleep(ShardPool.POLL)
+        finally:
+            for process, shard, output in running:
+                process.kill()
+                process.wait()
+
+    def remove(self):
+        self.close()
+        shutil.rmtree(self.directory, True)
+
+def shardMain(argv):
+    """Worker side of ShardPool: matches one shard against every variant."""
+    variants, shard, output = argv
+    with open(variants, 'rb') as f:
+        matcher = Matcher(json.loads(f.read().decode('utf-8')))
+    with open(shard, 'rb') as f:
+        with open(output, 'wb') as out:
+            for line in iter(f.readline, b''):
+                index, length = [int(field) for field in line.split()]
+                for variant, offset in matcher.finditer(decode(f.read(length))):
+                    out.write(encode(json.dumps([variant, index, offset])))
+                    out.write(b'\n')
+    return 0
+
+class TraceStore:
+    """Saves traces to and loads them from gzip-compressed JSON Lines files.
+
+    Bodies are not stored. Each site map item is stored with a digest of its
+    content, so that a reload can reuse the saved hits of unchanged items and
+    only re-scan the ones that are new or have changed.
+    """
+
+    VERSION = 3
+
+    @staticmethod
+    def save(path, snapshot, index):
+        # Outputs that a stopped trace never got to are saved as not scanned
+        scanned = set(id(sitem) for sitem in index.scanned())
+        with gzip.open(path, 'wb') as f:
+            TraceStore.write(f, ['tracer', TraceStore.VERSION])
+            for item in snapshot.items:
+                service = [item.service.protocol, item.service.host, item.service.port]
+                parameters = [[param.name, param.value] for param in item.parameters]
+                done = item.message is None or not item.scope or id(item) in scanned
+                TraceStore.write(f, ['item', service, item.url, item.method, parameters, item.scope, item.offset, item.digest, done])
+            for variant, found in index.hits.items():
+                TraceStore.write(f, ['hits', variant, [[sitem.index, offset] for sitem, offset in found]])
+
+    @staticmethod
+    def load(path):
+        """Returns the saved SiteMapItems (without bodies), their (variant, item index, offset) hits
+        and the indexes of the items whose responses were not scanned.
+
+        Version 2 files, which predate the scanned flag, count every item as scanned.
+        """
+        items = list()
+        found = list()
+        unscanned = set()
+        with gzip.open(path, 'rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            if header not in (['tracer', 2], ['tracer', TraceStore.VERSION]):
+                raise ValueError('Unsupported trace file: {}'.format(path))
+            for line in f:
+                record = json.loads(line.decode('utf-8'))
+                if record[0] == 'item':
+                    kind, service, url, method, parameters, scope, offset, digest = record[:8]
+                    parameters = [Parameter(name, value) for name, value in parameters]
+                    if record[8:] == [False]:
+                        unscanned.add(len(items))
+                    items.append(SiteMapItem(len(items), Service(*service), url, method, parameters, scope, offset, None, digest))
+                elif record[0] == 'hits':
+                    for index, offset in record[2]:
+                        found.append((record[1], index, offset))
+        return items, found, unscanned
+
+    @staticmethod
+    def reuse(snapshot, items, found, unscanned):
+        """Matches loaded items to the items of snapshot by digest and scope.
+
+        Returns the items whose saved hits still hold, those hits as (variant,
+        sitem, offset), and the items of snapshot that must be scanned again.
+        Saved items that have left the site map are restored into snapshot,
+        but stale copies of changed ones are not.
+        """
+        saved = dict()
+        for item in items:
+            if item.index in unscanned:
+                continue
+            saved.setdefault((item.digest, item.scope), collections.deque()).append(item)
+        mapping = dict()
+        restored = list()
+        changed = list()
+        for item in snapshot.items:
+            candidates = saved.get((item.digest, item.scope))
+            if candidates:
+                mapping[candidates.popleft().index] = item
+                restored.append(item)
+            else:
+                changed.append(item)
+        current = set((origin(item.service), item.url, item.method) for item in snapshot.items)
+        for item in items:
+            if item.index not in mapping and (origin(item.service), item.url, item.method) not in current:
+                index = item.index
+                mapping[index] = snapshot.restore(item)
+                restored.append(item)
+        return restored, [(variant, mapping[index], offset) for variant, index, offset in found if index in mapping], changed
+
+    @staticmethod
+    def write(f, record):
+        f.write(json.dumps(record).encode('utf-8'))
+        f.write(b'\n')
+
+def splitMessage(raw):
+    """Splits a raw HTTP message into its start line, headers and body offset."""
+    end = raw.find('\r\n\r\n')
+    offset = end + 4
+    if end < 0:
+        end = raw.find('\n\n')
+        offset = end + 2
+    if end < 0:
+        end = offset = len(raw)
+    lines = raw[:end].splitlines()
+    headers = list()
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers.append((name.strip(), value.strip()))
+    return (lines[0] if lines else ''), headers, offset
+
+def splitPairs(data, separator):
+    pairs = list()
+    for pair in data.split(separator):
+        name, sep, value = pair.strip().partition('=')
+        if name:
+            pairs.append(Parameter(name, value))
+    return pairs
+
+def jsonParameters(data, name=None):
+    if isinstance(data, dict):
+        parameters = list()
+        for key, value in data.items():
+            parameters.extend(jsonParameters(value, key))
+        return parameters
+    if isinstance(data, list):
+        parameters = list()
+        for value in data:
+            parameters.extend(jsonParameters(value, name))
+        return parameters
+    if name is None or data is None:
+        return list()
+    return [Parameter(name, data if isinstance(data, (str, type(u''))) else json.dumps(data))]
+
+def requestParameters(url, headers, body):
+    """Extracts URL, cookie and body parameters the way Burp reports them (values not decoded)."""
+    parameters = splitPairs(urlparse(url).query, '&') if urlparse(url).query else list()
+    contentType = ''
+    for name, value in headers:
+        if name.lower() == 'cookie':
+            parameters.extend(splitPairs(value, ';'))
+        elif name.lower() == 'content-type':
+            contentType = value.lower()
+    if body:
+        if 'json' in contentType:
+            try:
+                parameters.extend(jsonParameters(json.loads(body)))
+            except ValueError:
+                pass
+        elif 'x-www-form-urlencoded' in contentType or (not contentType and '=' in body):
+            parameters.extend(splitPairs(body, '&'))
+    return parameters
+
+class ExportReader:
+    """Streams SiteMapItems out of a Burp "Save items" XML export or a HAR file.
+
+    Items are produced one at a time so that exports larger than memory can be
+    traced. URLs are in scope if they match any of the scope patterns, or if
+    no patterns are given.
+    """
+
+    def __init__(self, path, scope=None, filter=None):
+        self.path = path
+        self.scope = [re.compile(pattern) for pattern in (scope or list())]
+        self.filter = filter if filter is not None else ResponseFilter()
+
+    def isInScope(self, url):
+        return not self.scope or any(pattern.search(url) for pattern in self.scope)
+
+    def items(self, bodies=True):
+        exchanges = self.har() if self.path.lower().endswith('.har') else self.xml()
+        index = 0
+        for service, url, method, parameters, request, response, offset, mimeType in exchanges:
+            scope = self.isInScope(url)
+            if response is not None and not self.filter.accepts(len(response) - offset, mimeType):
+                response = None
+            message = response if bodies and scope else None
+            yield SiteMapItem(index, service, url, method, parameters, scope, offset, message, digest(service, request, response))
+            index += 1
+
+    def xml(self):
+        root = None
+        for event, element in ElementTree.iterparse(self.path, events=('start', 'end')):
+            if root is None:
+                root = element
+            if event != 'end' or element.tag != 'item':
+                continue
+            fields = dict()
+            for child in element:
+                text = child.text or ''
+                if child.get('base64') == 'true':
+                    text = decode(base64.b64decode(text))
+                fields[child.tag] = text
+            # Detach finished items from the root too, so that memory stays flat
+            root.clear()
+            service = Service(fields.get('protocol', 'http'), fields.get('host', ''), int(fields.get('port') or 0))
+            request = fields.get('request', '')
+            line, headers, offset = splitMessage(request)
+            method = line.split(' ')[0] if line else fields.get('method', '')
+            parameters = requestParameters(fields.get('url', ''), headers, request[offset:])
+            response = fields.get('response') or None
+            yield service, fields.get('url', ''), method, parameters, request, response, (splitMessage(response)[2] if response else None), fields.get('mimetype', '')
+
+    def har(self):
+        for entry in HarEntries(self.path):
+            request = entry.get('request', dict())
+            response = entry.get('response', dict())
+            url = request.get('url', '')
+            parsed = urlparse(url)
+            port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+            service = Service(parsed.scheme, parsed.hostname or '', port)
+            headers = [(header.get('name', ''), header.get('value', '')) for header in request.get('headers', list())]
+            data = request.get('postData', dict())
+            if data.get('mimeType'):
+                headers.append(('Content-Type', data['mimeType']))
+            parameters = requestParameters(url, headers, data.get('text', ''))
+            content = response.get('content', dict())
+            body = content.get('text')
+            if body is not None and content.get('encoding') == 'base64':
+                body = decode(base64.b64decode(body))
+            raw = '{} {}\n{}'.format(request.get('method', ''), url, data.get('text', ''))
+            yield service, url, request.get('method', ''), parameters, raw, body, (0 if body is not None else None), content.get('mimeType', '')
+
+class HarEntries:
+    """Iterates over the entries of a HAR file without loading the whole file.
+
+    Raises ValueError, naming the file and character position, if there is no
+    entries array or if an entry cannot be decoded by the end of the file.
+    """
+
+    CHUNK = 1 << 16
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        decoder = json.JSONDecoder()
+        with io.open(self.path, encoding='utf-8') as f:
+            buffer = ''
+            # Position of the start of buffer in the file
+            position = 0
+            # Seek to the entries array
+            while True:
+                match = re.search(r'(?<!\\)"entries"\s*:\s*\[', buffer)
+                if match:
+                    position += match.end()
+                    buffer = buffer[match.end():]
+                    break
+                chunk = f.read(HarEntries.CHUNK)
+                if not chunk:
+                    raise ValueError('No entries array in HAR file {}'.format(self.path))
+                position += max(0, len(buffer) - 64)
+                buffer = buffer[-64:] + chunk
+            # Decode one entry at a time
+            while True:
+                stripped = buffer.lstrip().lstrip(',').lstrip()
+                position += len(buffer) - len(stripped)
+                buffer = stripped
+                if buffer.startswith(']'):
+                    return
+                try:
+                    entry, end = decoder.raw_decode(buffer)
+                except ValueError as e:
+                    chunk = f.read(HarEntries.CHUNK)
+                    if not chunk:
+                        raise ValueError('Malformed or truncated HAR file {}: cannot decode the entry at character {} ({})'.format(self.path, position, e))
+                    buffer += chunk
+                    continue
+                position += end
+                buffer = buffer[end:]
+                yield entry
+
+class Tracer:
+    """Headless two-pass trace over an export.
+
+    The first pass indexes every input value without keeping response bodies;
+    the second pass streams each response once and matches it against every
+    value, so memory is bounded by the inputs rather than by the export.
+    """
+
+    def __init__(self, reader, filter=None):
+        self.reader = reader
+        self.filter = filter
+
+    def hits(self):
+        index = TraceIndex(None, self.filter)
+        index.prepare(item for item in self.reader.items(False) if item.scope and item.parameters)
+        for sitem in self.reader.items(True):
+            if sitem.scope and sitem.message is not None:
+                for hit in index.match(sitem):
+                    yield hit
+
+class EdgeIndex:
+    """Prefix indexes over the edges of a trace, for filtering them as the user types.
+
+    Edges are numbered in the order they are added and indexed by parameter
+    name, parameter value, input endpoint and output endpoint; endpoints are
+    indexed both as full URLs without a query and as bare paths. Keys are
+    lowercased, and each field's keys are sorted on the first search after
+    they change, so that a prefix is found by bisection.
+    """
+
+    FIELDS = ('name', 'value', 'in', 'out')
+
+    def __init__(self):
+        self.postings = dict((field, dict()) for field in EdgeIndex.FIELDS)
+        self.keys = dict()
+        self.endpoints = dict()
+
+    @staticmethod
+    def fields(item, param, sitem, endpoint=None):
+        endpoint = endpoint or EdgeIndex.endpoint
+        return [('name', [param.name.lower()]), ('value', [param.value.lower()]), ('in', endpoint(item.url)), ('out', endpoint(sitem.url))]
+
+    @staticmethod
+    def endpoint(url):
+        parsed = urlparse(url)
+        return list(set(['{}://{}{}'.format(parsed.scheme, parsed.netloc, parsed.path).lower(), parsed.path.lower()]))
+
+    def cached(self, url):
+        # Site map URLs repeat across edges, so parse each one once
+        keys = self.endpoints.get(url)
+        if keys is None:
+            keys = self.endpoints[url] = EdgeIndex.endpoint(url)
+        return keys
+
+    @staticmethod
+    def parse(query):
+        """Returns the terms of query as (fields, prefix) pairs.
+
+        Terms are separated by whitespace and must all match. A term such as
+        name:csrf only matches its field; any other term matches any field.
+        """
+        terms = list()
+        for term in query.lower().split():
+            field, separator, prefix = term.partition(':')
+            if separator and field in EdgeIndex.FIELDS and prefix:
+                terms.append(((field,), prefix))
+            else:
+                terms.append((EdgeIndex.FIELDS, term))
+        return terms
+
+    def add(self, number, item, param, sitem):
+        for field, keys in EdgeIndex.fields(item, param, sitem, self.cached):
+            for key in keys:
+                postings = self.postings[field].get(key)
+                if postings is None:
+                    postings = self.postings[field][key] = list()
+                    self.keys.pop(field, None)
+                postings.append(number)
+
+    def search(self, terms):
+        """Returns the sorted numbers of the edges that match every term."""
+        result = None
+        for fields, prefix in terms:
+            found = set()
+            for field in fields:
+                if field not in self.keys:
+                    self.keys[field] = sorted(self.postings[field])
+                keys = self.keys[field]
+                for key in itertools.islice(keys, bisect.bisect_left(keys, prefix), None):
+                    if not key.startswith(prefix):
+                        break
+                    found.update(self.postings[field][key])
+            result = found if result is None else result & found
+            if not result:
+                break
+        return sorted(result or ())
+
+    @staticmethod
+    def matches(terms, item, param, sitem):
+        """Returns whether a single edge matches every term, without the index."""
+        fields = dict(EdgeIndex.fields(item, param, sitem))
+        return all(any(key.startswith(prefix) for field in names for key in fields[field]) for names, prefix in terms)
+
+def edge(item, param, sitem, offset, length, encoding, context=None):
+    """Returns the record of a single trace hit, with its context if it was classified."""
+    record = collections.OrderedDict()
+    record['input'] = collections.OrderedDict([('service', origin(item.service)), ('url', item.url), ('method', item.method)])
+    record['parameter'] = collections.OrderedDict([('name', param.name), ('value', param.value)])
+    record['output'] = collections.OrderedDict([('service', origin(sitem.service)), ('url', sitem.url), ('method', sitem.method)])
+    record['offset'] = offset
+    record['length'] = length
+    record['encoding'] = encoding
+    record['context'] = context
+    record['excerpt'] = excerpt(sitem.message, offset, length, base=sitem.offset) if sitem.message is not None else None
+    return record
+
+class EdgeWriter:
+    """Writes trace hits as JSON Lines, one record per hit."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, item, param, sitem, offset, length, encoding, context=None):
+        self.f.write(json.dumps(edge(item, param, sitem, offset, length, encoding, context)))
+        self.f.write('\n')
+
+class CsvWriter:
+    """Writes trace hits as CSV, one row per hit below a header row.
+
+    Nested record fields are flattened into input_url, parameter_name and so on.
+    """
+
+    def __init__(self, f):
+        self.writer = csv.writer(f)
+        self.header = False
+
+    def write(self, item, param, sitem, offset, length, encoding, context=None):
+        names = list()
+        cells = list()
+        for name, value in edge(item, param, sitem, offset, length, encoding, context).items():
+            for field, cell in (value.items() if isinstance(value, dict) else [(None, value)]):
+                names.append(name if field is None else '{}_{}'.format(name, field))
+                cells.append('' if cell is None else cell if isinstance(cell, type(u'')) else str(cell))
+        if not self.header:
+            self.writer.writerow(names)
+            self.header = True
+        # The Python 2 csv module only writes byte strings
+        self.writer.writerow([encode(cell) for cell in cells] if str is bytes else cells)
+
+def openEdgeWriter(path, format):
+    """Opens path for writing and returns the file and a writer for format ('jsonl' or 'csv')."""
+    if format == 'csv':
+        f = open(path, 'wb') if str is bytes else open(path, 'w', newline='', encoding='utf-8')
+        return f, CsvWriter(f)
+    f = open(path, 'w')
+    return f, EdgeWriter(f)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['shard']:
+        return shardMain(argv[1:])
+    parser = argparse.ArgumentParser(description='Trace where request parameters are reflected in a Burp XML export or HAR file.')
+    parser.add_argument('export', help='Burp "Save items" XML export or HAR file')
+    parser.add_argument('--scope', action='append', metavar='REGEX', help='only trace URLs matching REGEX (repeatable)')
+    parser.add_argument('--output', metavar='FILE', help='write to FILE instead of stdout')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help='output format (default: csv if FILE ends in .csv, jsonl otherwise)')
+    parser.add_argument('--min-length', type=int, default=3, metavar='N', help='skip values shorter than N characters (default: 3)')
+    parser.add_argument('--keep-numbers', action='store_true', help='also trace plain numbers')
+    parser.add_argument('--keep-booleans', action='store_true', help='also trace boolean-like values such as true, no or null')
+    parser.add_argument('--cap', type=int, default=100, metavar='N', help='keep at most N hits per value, across its encodings, 0 for no cap (default: 100)')
+    parser.add_argument('--max-body-size', type=int, default=4 << 20, metavar='BYTES', help='skip larger response bodies, 0 for no limit (default: 4 MiB)')
+    parser.add_argument('--skip-mime-types', default=','.join(ResponseFilter.MIME_TYPES), metavar='LIST', help='comma-separated MIME types not to scan (default: %(default)s)')
+    args = parser.parse_args(argv)
+    filter = ValueFilter(args.min_length, not args.keep_numbers, not args.keep_booleans, args.cap)
+    reader = ExportReader(args.export, args.scope, ResponseFilter(args.max_body_size, args.skip_mime_types.split(',')))
+    format = args.format or ('csv' if args.output and args.output.lower().endswith('.csv') else 'jsonl')
+    if args.output:
+        f, writer = openEdgeWriter(args.output, format)
+    else:
+        f, writer = sys.stdout, (CsvWriter if format == 'csv' else EdgeWriter)(sys.stdout)
+    try:
+        # Hits arrive grouped by response, so caching one body tokenizes each once
+        contexts = ContextClassifier(1)
+        for hit in Tracer(reader, filter).hits():
+            writer.write(*hit, context=contexts.label(hit[2], hit[3]))
+    except (ValueError, ElementTree.ParseError) as e:
+        parser.exit(1, '{}: error: {}\n'.format(parser.prog, e))
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())